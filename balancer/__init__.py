@@ -1,3 +1,5 @@
+from balancer.context import read_from_replica, use_master, use_pool
+
 VERSION = (0, 5, 0, "f", 1) # following PEP 386
 DEV_N = 1 # for PyPi releases, set this to None
 
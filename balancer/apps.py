@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class BalancerConfig(AppConfig):
+    name = 'balancer'
+
+    def ready(self):
+        from django.db import router
+        # Django creates the routers on the first query.  Creating them now
+        # reports a bad pool configuration at startup instead.
+        router.routers
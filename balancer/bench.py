@@ -0,0 +1,205 @@
+"""
+Microbenchmarks for the routing decision of every pool router.
+
+Run with ``python -m balancer.bench``.  Each router is measured for every
+combination of pool size and thread count, reporting routing decisions per
+second and the memory allocated per decision.  Results can be written as
+JSON with ``--output`` and compared against an earlier run with
+``--baseline``, which exits with a non-zero status when a router got slower
+or started allocating more than the tolerance allows.
+"""
+import argparse
+import inspect
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_POOL_SIZES = (2, 10, 50, 200)
+DEFAULT_THREADS = (1, 4, 16, 64)
+
+
+class BenchModel(object):
+    """Stands in for a model class in the routing calls."""
+
+    class _meta(object):
+        app_label = 'bench'
+        model_name = 'model'
+        label_lower = 'bench.model'
+
+
+def configure(pool_size):
+    """Configure Django, if needed, with enough databases for the pool."""
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                   'NAME': ':memory:'}},
+            INSTALLED_APPS=[],
+            MASTER_DATABASE='default',
+            DATABASE_POOL_CONNECT_CHECK=False,
+            DATABASE_POOL_LAG_PROBE='balancer.lag.MemoryLagProbe',
+            DATABASE_POOL_POSITION_PROVIDER=(
+                'balancer.causal.FakePositionProvider'),
+        )
+        import django
+        django.setup()
+    settings.DATABASE_POOL = dict(('db%d' % i, 1 + i % 3)
+                                  for i in range(pool_size))
+    databases = dict(settings.DATABASES)
+    for alias in settings.DATABASE_POOL:
+        databases.setdefault(alias, {'ENGINE': 'django.db.backends.sqlite3',
+                                     'NAME': ':memory:'})
+    settings.DATABASES = databases
+
+
+def get_router_classes():
+    """Return every concrete router class in balancer.routers, by name."""
+    from balancer import routers
+    return dict(
+        (name, cls) for name, cls in inspect.getmembers(routers,
+                                                        inspect.isclass)
+        if issubclass(cls, routers.BasePoolRouter) and
+        cls.__module__ == routers.__name__ and
+        hasattr(cls, 'db_for_read')
+    )
+
+
+def measure_rate(route, decisions, threads):
+    """Return the routing decisions per second across ``threads`` threads."""
+    per_thread = max(1, decisions // threads)
+    barrier = threading.Barrier(threads + 1)
+
+    def run():
+        barrier.wait()
+        for i in range(per_thread):
+            route(BenchModel)
+
+    workers = [threading.Thread(target=run) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def measure_allocations(route, decisions):
+    """
+    Return the bytes allocated per decision, both retained and at the peak,
+    in a single thread.
+    """
+    route(BenchModel)
+    tracemalloc.start()
+    try:
+        before, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for i in range(decisions):
+            route(BenchModel)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'retained_bytes': float(after - before) / decisions,
+        'peak_bytes': float(peak - before),
+    }
+
+
+def run(router_names=None, pool_sizes=DEFAULT_POOL_SIZES,
+        thread_counts=DEFAULT_THREADS, decisions=20000, out=None):
+    """Run the benchmarks and return a list of result dicts."""
+    results = []
+    for pool_size in pool_sizes:
+        configure(pool_size)
+        classes = get_router_classes()
+        for name in sorted(router_names or classes):
+            router = classes[name]()
+            for threads in thread_counts:
+                result = {
+                    'router': name,
+                    'pool_size': pool_size,
+                    'threads': threads,
+                    'decisions_per_second': measure_rate(
+                        router.db_for_read, decisions, threads),
+                }
+                if threads == 1:
+                    result.update(measure_allocations(
+                        router.db_for_read, min(decisions, 2000)))
+                results.append(result)
+                if out is not None:
+                    out.write('%-36s pool=%-4d threads=%-3d %12.0f/s\n' % (
+                        name, pool_size, threads,
+                        result['decisions_per_second']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return a list of descriptions of the results that regressed by more than
+    ``tolerance``, a fraction, against the baseline results.
+    """
+    def key(result):
+        return (result['router'], result['pool_size'], result['threads'])
+
+    previous = dict((key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        rate, old_rate = (result['decisions_per_second'],
+                          old['decisions_per_second'])
+        if rate < old_rate * (1 - tolerance):
+            regressions.append('%s pool=%d threads=%d: %.0f/s, was %.0f/s' % (
+                key(result) + (rate, old_rate)))
+        retained = result.get('retained_bytes')
+        old_retained = old.get('retained_bytes')
+        if (retained is not None and old_retained is not None and
+                retained > max(old_retained, 1) * (1 + tolerance)):
+            regressions.append(
+                '%s pool=%d threads=%d: retains %.1f bytes per decision, '
+                'was %.1f' % (key(result) + (retained, old_retained)))
+    return regressions
+
+
+def main(argv=None):
+    def numbers(value):
+        return [int(number) for number in value.split(',')]
+
+    parser = argparse.ArgumentParser(prog='python -m balancer.bench',
+                                     description=__doc__.strip())
+    parser.add_argument('--routers', type=lambda value: value.split(','),
+                        help='comma separated router class names')
+    parser.add_argument('--pool-sizes', type=numbers,
+                        default=list(DEFAULT_POOL_SIZES))
+    parser.add_argument('--threads', type=numbers,
+                        default=list(DEFAULT_THREADS))
+    parser.add_argument('--decisions', type=int, default=20000,
+                        help='routing decisions per measurement')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.routers, args.pool_sizes, args.threads,
+                  args.decisions, out=sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results}, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            sys.stdout.write('REGRESSION %s\n' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
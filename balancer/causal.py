@@ -0,0 +1,253 @@
+"""
+Replication positions for causally consistent reads.
+
+After a write, the causal middleware asks a position provider for the
+master's current replication position and hands it back to the client as a
+token.  Reads made with a token only go to slaves that have replayed past it.
+Positions are opaque strings; only the provider knows how to compare them.
+Each token is parsed once per request, since every read compares it with
+every slave.
+"""
+import itertools
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from balancer.selection import normalize_pool
+
+
+def get_provider():
+    """
+    Instantiate the provider named in the DATABASE_POOL_POSITION_PROVIDER
+    setting.
+    """
+    from django.conf import settings
+    path = getattr(settings, 'DATABASE_POOL_POSITION_PROVIDER',
+                   'balancer.causal.DatabasePositionProvider')
+    return import_string(path)()
+
+
+class BasePositionProvider(object):
+    """Subclasses must implement master_position and has_replayed."""
+
+    def master_position(self, alias):
+        """Return the current replication position of the master ``alias``."""
+        raise NotImplementedError
+
+    def parse_position(self, position):
+        """
+        Return ``position`` in the form has_replayed compares.  Raises
+        ValueError for positions that can't be parsed.
+        """
+        return position
+
+    def has_replayed(self, alias, position):
+        """
+        Check whether the slave ``alias`` has replayed up to ``position``, as
+        returned by parse_position.
+        """
+        raise NotImplementedError
+
+
+class FakePositionProvider(BasePositionProvider):
+    """
+    A provider for tests and local development.  Every call to
+    master_position returns a new, higher position, and slaves have replayed
+    whatever position is set for them by hand.
+    """
+    positions = {}
+    counter = itertools.count(1)
+
+    @classmethod
+    def set_position(cls, alias, position):
+        cls.positions[alias] = int(position)
+
+    @classmethod
+    def reset(cls):
+        cls.positions.clear()
+        cls.counter = itertools.count(1)
+
+    def master_position(self, alias):
+        position = next(self.counter)
+        self.positions[alias] = position
+        return str(position)
+
+    def parse_position(self, position):
+        return int(position)
+
+    def has_replayed(self, alias, position):
+        return self.positions.get(alias, 0) >= position
+
+
+class PostgreSQLPositionProvider(BasePositionProvider):
+    """
+    Compares WAL locations.  Each slave's replay location is cached for
+    ``interval`` seconds, since many reads check the same slave.
+    """
+    interval = 0.05
+
+    def __init__(self):
+        self.replayed = {}
+
+    @staticmethod
+    def parse(lsn):
+        high, low = lsn.split('/')
+        return (int(high, 16) << 32) + int(low, 16)
+
+    def query(self, alias, sql):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def master_position(self, alias):
+        return self.query(alias, 'SELECT pg_current_wal_lsn()')
+
+    def parse_position(self, position):
+        return self.parse(position)
+
+    def has_replayed(self, alias, position):
+        now = time.monotonic()
+        replayed, checked = self.replayed.get(alias, (None, 0))
+        if replayed is None or now - checked > self.interval:
+            lsn = self.query(alias, 'SELECT pg_last_wal_replay_lsn()')
+            replayed = self.parse(lsn) if lsn else 0
+            self.replayed[alias] = (replayed, now)
+        return replayed >= position
+
+
+class MySQLPositionProvider(BasePositionProvider):
+    """
+    Compares GTID sets, which requires GTID based replication.  Each slave's
+    executed GTID set is cached for ``interval`` seconds, since many reads
+    check the same slave, and compared with the position in Python.
+    """
+    interval = 0.05
+
+    def __init__(self):
+        self.replayed = {}
+
+    @staticmethod
+    def parse(gtid_set):
+        """
+        Return a dict mapping each source, a UUID with an optional tag, to
+        the sorted and merged ``(start, end)`` intervals of a GTID set.
+        """
+        sources = {}
+        for entry in gtid_set.replace('\n', '').split(','):
+            parts = entry.strip().lower().split(':')
+            if not parts[0]:
+                continue
+            if len(parts) < 2 or not parts[-1][:1].isdigit():
+                raise ValueError("Invalid GTID set %r." % gtid_set)
+            source = parts[0]
+            for part in parts[1:]:
+                if not part[:1].isdigit():
+                    # MySQL 8.3 tags apply to the intervals that follow.
+                    source = '%s:%s' % (parts[0], part)
+                    continue
+                start, _, end = part.partition('-')
+                sources.setdefault(source, []).append(
+                    (int(start), int(end or start)))
+        for source, intervals in sources.items():
+            intervals.sort()
+            merged = [intervals[0]]
+            for start, end in intervals[1:]:
+                if start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+                else:
+                    merged.append((start, end))
+            sources[source] = merged
+        return sources
+
+    @staticmethod
+    def is_subset(position, executed):
+        """Check whether the parsed GTID set ``position`` is executed."""
+        for source, intervals in position.items():
+            covering = executed.get(source, ())
+            for start, end in intervals:
+                if not any(low <= start and end <= high
+                           for low, high in covering):
+                    return False
+        return True
+
+    def query(self, alias, sql):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def master_position(self, alias):
+        return self.query(alias, 'SELECT @@GLOBAL.gtid_executed')
+
+    def parse_position(self, position):
+        return self.parse(position)
+
+    def has_replayed(self, alias, position):
+        now = time.monotonic()
+        replayed, checked = self.replayed.get(alias, (None, 0))
+        if replayed is None or now - checked > self.interval:
+            replayed = self.parse(
+                self.query(alias, 'SELECT @@GLOBAL.gtid_executed') or '')
+            self.replayed[alias] = (replayed, now)
+        return self.is_subset(position, replayed)
+
+
+class DatabasePositionProvider(BasePositionProvider):
+    """
+    Dispatches to the provider for each database's vendor.  Raises
+    ImproperlyConfigured when it is created if a database in the pool, or the
+    master, has no provider.
+    """
+    vendor_providers = {
+        'postgresql': PostgreSQLPositionProvider,
+        'mysql': MySQLPositionProvider,
+    }
+
+    def __init__(self):
+        from django.conf import settings
+        self.providers = {}
+        aliases = set(alias for alias, weight in
+                      normalize_pool(settings.DATABASE_POOL))
+        master = getattr(settings, 'MASTER_DATABASE', None)
+        if master is not None:
+            aliases.add(master)
+        for alias in sorted(aliases):
+            self.get_provider(alias)
+
+    def get_provider(self, alias):
+        vendor = connections[alias].vendor
+        provider = self.providers.get(vendor)
+        if provider is None:
+            try:
+                provider_class = self.vendor_providers[vendor]
+            except KeyError:
+                raise ImproperlyConfigured(
+                    "No position provider for the %r database %r; set "
+                    "DATABASE_POOL_POSITION_PROVIDER." % (vendor, alias))
+            provider = self.providers[vendor] = provider_class()
+        return provider
+
+    def master_position(self, alias):
+        return self.get_provider(alias).master_position(alias)
+
+    def parse_position(self, position):
+        """
+        Return a dict mapping each vendor to ``position`` as parsed by its
+        provider, leaving out vendors that can't parse it.
+        """
+        parsed = {}
+        for vendor, provider in self.providers.items():
+            try:
+                parsed[vendor] = provider.parse_position(position)
+            except ValueError:
+                pass
+        if not parsed:
+            raise ValueError("Invalid replication position %r." % position)
+        return parsed
+
+    def has_replayed(self, alias, position):
+        vendor = connections[alias].vendor
+        if vendor not in position:
+            return False
+        return self.get_provider(alias).has_replayed(alias, position[vendor])
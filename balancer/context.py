@@ -0,0 +1,191 @@
+"""
+Request scopes for sticky database selection.
+
+The middleware opens a scope for each request.  Within a scope, each pool
+router remembers the database it selected first and keeps returning it, so
+one request reads from one slave.  Outside of a scope every query selects a
+database on its own.
+
+The number of open scopes using each database is counted, so that a draining
+database can tell when the requests using it have finished.
+
+An affinity key, such as a tenant or user id, can also be set for the current
+context.  The affinity routers send every read made under the same key to the
+same database.
+
+Finally, code can override where the pool routers send its reads, with
+``use_master()``, ``use_pool(name)`` or ``read_from_replica``.
+"""
+import functools
+import inspect
+import threading
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+
+_scope = ContextVar('balancer_scope', default=None)
+_affinity_key = ContextVar('balancer_affinity_key', default=None)
+_override = ContextVar('balancer_override', default=None)
+
+# The kinds of routing override
+MASTER = 'master'
+POOL = 'pool'
+REPLICA = 'replica'
+_bound = {}
+_lock = threading.Lock()
+
+
+def begin_scope():
+    """Open a new scope, returning a token for end_scope."""
+    return _scope.set({})
+
+
+def end_scope(token):
+    """Close the scope opened by begin_scope, restoring the previous one."""
+    scope = _scope.get()
+    if scope:
+        with _lock:
+            for alias in scope.values():
+                _bound[alias] -= 1
+    _scope.reset(token)
+
+
+def bind(scope, key, alias):
+    """Remember that ``key``, usually a router, selected ``alias``."""
+    with _lock:
+        previous = scope.get(key)
+        if previous is not None:
+            _bound[previous] -= 1
+        scope[key] = alias
+        _bound[alias] = _bound.get(alias, 0) + 1
+
+
+def scopes_using(alias):
+    """Return the number of open scopes that have selected ``alias``."""
+    return _bound.get(alias, 0)
+
+
+def get_scope():
+    """
+    Return the current scope, a dict mapping routers to the database they
+    selected, or None outside of a scope.
+    """
+    return _scope.get()
+
+
+@contextmanager
+def sticky_scope():
+    """
+    Open a scope for code that doesn't run in a request, such as a task::
+
+        with sticky_scope():
+            ...
+    """
+    token = begin_scope()
+    try:
+        yield
+    finally:
+        end_scope(token)
+
+
+def set_affinity_key(key):
+    """
+    Route reads in the current context by ``key``, returning a token for
+    reset_affinity_key.
+    """
+    return _affinity_key.set(key)
+
+
+def reset_affinity_key(token):
+    _affinity_key.reset(token)
+
+
+def get_affinity_key():
+    """Return the affinity key of the current context, or None."""
+    return _affinity_key.get()
+
+
+@contextmanager
+def affinity(key):
+    """
+    Route reads by ``key`` within the block, for example a tenant id::
+
+        with affinity(request.tenant.pk):
+            ...
+    """
+    token = set_affinity_key(key)
+    try:
+        yield
+    finally:
+        reset_affinity_key(token)
+
+
+def get_override():
+    """
+    Return the routing override of the current context as a ``(kind, name)``
+    tuple, where ``kind`` is MASTER, POOL or REPLICA and ``name`` is the name
+    of the pool for POOL, or None if reads are routed normally.
+    """
+    return _override.get()
+
+
+class override(ContextDecorator):
+    """
+    Set a routing override within a block, or in a decorated function.  A
+    decorated coroutine function sets it inside the coroutine, where its
+    queries run.
+    """
+
+    def __init__(self, kind, name=None):
+        self.override = (kind, name)
+        self.tokens = []
+
+    def __enter__(self):
+        self.tokens.append(_override.set(self.override))
+        return self
+
+    def __exit__(self, *exc_info):
+        _override.reset(self.tokens.pop())
+
+    def _recreate_cm(self):
+        return override(*self.override)
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self._recreate_cm():
+                    return await func(*args, **kwargs)
+            return wrapper
+        return super(override, self).__call__(func)
+
+
+def use_master():
+    """
+    Send reads to the master database within the block, or in a decorated
+    function or coroutine function::
+
+        with use_master():
+            ...
+    """
+    return override(MASTER)
+
+
+def use_pool(name):
+    """
+    Send reads to the named pool from the DATABASE_POOLS setting within the
+    block, or in a decorated function or coroutine function, even when the
+    request is pinned::
+
+        @use_pool('reporting')
+        def monthly_report():
+            ...
+    """
+    return override(POOL, name)
+
+
+def read_from_replica(func):
+    """
+    Decorate a function, or a coroutine function, so that its reads go to the
+    pool even when the request is pinned to the master.
+    """
+    return override(REPLICA)(func)
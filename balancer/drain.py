@@ -0,0 +1,83 @@
+"""
+Draining databases for maintenance.
+
+A draining database is left out of the pool for new requests, while requests
+that already selected it, and queries and transactions already running on
+it, finish normally.  ``wait_until_idle`` reports when nothing is using it any
+more: queries in flight and open transactions are counted by every pool
+router from when it is created, and, with the DATABASE_POOL_SHARED_STATE
+setting, across every process on the host.  Request scopes are only seen in
+the current process.
+Draining applies to the current process; to drain a database on every
+process, list it in the DATABASE_POOL_FILE, for example with
+``set_database_pool --drain``.
+"""
+import time
+
+from django.core.signals import request_finished
+
+from balancer import context, instrumentation, shared
+from balancer.load import tracker
+
+# The draining aliases, replaced on every change so readers need no lock
+draining = frozenset()
+
+
+def _request_finished(**kwargs):
+    tracker.end_transactions()
+
+
+def install_tracker():
+    """
+    Count the queries in flight and the open transactions on every
+    database, sharing the counts with the other processes on the host if
+    DATABASE_POOL_SHARED_STATE is set.
+    """
+    state = shared.get_state()
+    if state is not None:
+        tracker.share(state)
+    instrumentation.add_observer(tracker)
+    request_finished.connect(_request_finished, dispatch_uid='balancer.drain')
+
+
+def drain(alias):
+    """Stop new requests from selecting ``alias``."""
+    global draining
+    draining = draining | frozenset([alias])
+
+
+def undrain(alias):
+    """Let new requests select ``alias`` again."""
+    global draining
+    draining = draining - frozenset([alias])
+
+
+def set_draining(aliases):
+    """Replace the set of draining aliases."""
+    global draining
+    draining = frozenset(aliases)
+
+
+def is_idle(alias):
+    """
+    Check whether no request scope in this process has selected ``alias``
+    and no query or transaction is running on it, in this process or, with
+    shared state, in any process on the host.
+    """
+    tracker.end_transactions()
+    return (context.scopes_using(alias) == 0 and
+            tracker.get_in_flight(alias) <= 0 and
+            tracker.get_transactions(alias) <= 0)
+
+
+def wait_until_idle(alias, timeout=None, interval=0.1):
+    """
+    Wait until ``alias`` is idle, returning True, or until ``timeout``
+    seconds have passed, returning False.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not is_idle(alias):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
@@ -0,0 +1,189 @@
+"""
+Health tracking for the databases in the pool.
+
+Each alias gets a circuit breaker.  Failures open the circuit, which takes the
+alias out of the pool for a backoff period that doubles each time the circuit
+opens again.  Once the backoff expires the circuit is half-open: the alias gets
+traffic again, and the next success closes the circuit while the next failure
+opens it for longer.  Only connection failures count; a query that fails on a
+working connection says nothing about the database's health.
+"""
+import threading
+import time
+
+from django.db import DatabaseError, InterfaceError, OperationalError
+from django.db import connections
+
+from balancer.instrumentation import QueryObserver
+
+
+def is_connection_failure(connection, error):
+    """
+    Check whether ``error``, raised by a query on ``connection``, means that
+    the connection is broken, rather than that the query failed on a healthy
+    database, as with statement timeouts, lock waits and SQL errors.
+    """
+    if isinstance(error, InterfaceError):
+        return True
+    if not isinstance(error, OperationalError):
+        return False
+    if connection.connection is None:
+        return True
+    try:
+        return not connection.is_usable()
+    except Exception:
+        return True
+
+
+class Circuit(object):
+    """The state of a single alias's circuit breaker."""
+
+    def __init__(self):
+        self.failures = 0
+        self.backoff = 0
+        self.open_until = 0
+
+
+class HealthRegistry(QueryObserver):
+    """
+    Tracks the circuits for every alias in this process.  Successful queries
+    on a healthy alias only cost a dict lookup; the lock is only taken when a
+    circuit changes state.  Once shared, circuits opened by any process using
+    the shared state take the alias out of the pool in every process, while
+    the failure counts and backoff stay with each process.
+    """
+
+    def __init__(self, failure_threshold=3, backoff=1, max_backoff=60):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.shared = None
+        self.reset()
+
+    def reset(self):
+        """Close every circuit."""
+        self._lock = threading.Lock()
+        self._circuits = {}
+        self._unhealthy = frozenset()
+        self._next_expiry = float('inf')
+        self._generation = None
+        if self.shared is not None:
+            self.shared.close_circuits()
+
+    def share(self, state):
+        """Publish opened circuits to a SharedState, and see its circuits."""
+        if self.shared is not state:
+            self.shared = state
+            self._generation = None
+
+    def configure(self, failure_threshold=None, backoff=None,
+                  max_backoff=None):
+        if failure_threshold is not None:
+            self.failure_threshold = failure_threshold
+        if backoff is not None:
+            self.base_backoff = backoff
+        if max_backoff is not None:
+            self.max_backoff = max_backoff
+
+    def get_unhealthy(self):
+        """Return a frozenset of the aliases whose circuits are open."""
+        shared = self.shared
+        if (time.monotonic() >= self._next_expiry or
+                shared is not None and
+                shared.generation != self._generation):
+            with self._lock:
+                self._refresh(time.monotonic())
+        return self._unhealthy
+
+    def is_healthy(self, alias):
+        return alias not in self.get_unhealthy()
+
+    def record_success(self, alias):
+        """Close the circuit for ``alias`` if it has seen any failures."""
+        if alias not in self._circuits:
+            return
+        with self._lock:
+            if self._circuits.pop(alias, None) is not None:
+                self._refresh(time.monotonic())
+
+    def record_failure(self, alias):
+        """
+        Count a failure for ``alias``, opening its circuit once
+        ``failure_threshold`` failures have been seen without a success.
+        A failure while the circuit is half-open reopens it straight away.
+        """
+        with self._lock:
+            circuit = self._circuits.get(alias)
+            if circuit is None:
+                circuit = self._circuits[alias] = Circuit()
+            circuit.failures += 1
+            if circuit.backoff or circuit.failures >= self.failure_threshold:
+                self._open(alias, circuit)
+
+    def trip(self, alias):
+        """Open the circuit for ``alias`` immediately."""
+        with self._lock:
+            circuit = self._circuits.get(alias)
+            if circuit is None:
+                circuit = self._circuits[alias] = Circuit()
+            circuit.failures += 1
+            self._open(alias, circuit)
+
+    def check_connection(self, alias):
+        """
+        Make sure this thread has a connection to ``alias``, opening one if
+        needed.  A failure to connect trips the circuit and returns False.
+        """
+        connection = connections[alias]
+        if connection.connection is not None:
+            return True
+        try:
+            connection.ensure_connection()
+        except DatabaseError:
+            self.trip(alias)
+            return False
+        return True
+
+    def query_finished(self, alias, duration, error):
+        if error is None:
+            self.record_success(alias)
+        elif isinstance(error, InterfaceError):
+            # The connection itself is gone.
+            self.trip(alias)
+        elif is_connection_failure(connections[alias], error):
+            self.record_failure(alias)
+
+    def _open(self, alias, circuit):
+        now = time.monotonic()
+        if circuit.open_until > now:
+            # Already open; concurrent failures shouldn't extend the backoff.
+            return
+        if circuit.backoff:
+            circuit.backoff = min(circuit.backoff * 2, self.max_backoff)
+        else:
+            circuit.backoff = self.base_backoff
+        circuit.open_until = now + circuit.backoff
+        if self.shared is not None:
+            self.shared.open_circuit(alias, time.time() + circuit.backoff)
+        self._refresh(now)
+
+    def _refresh(self, now):
+        unhealthy = []
+        next_expiry = float('inf')
+        for alias, circuit in self._circuits.items():
+            if circuit.open_until > now:
+                unhealthy.append(alias)
+                next_expiry = min(next_expiry, circuit.open_until)
+        shared = self.shared
+        if shared is not None:
+            self._generation = shared.generation
+            wall_now = time.time()
+            for alias, until in shared.get_open_circuits(wall_now).items():
+                unhealthy.append(alias)
+                next_expiry = min(next_expiry, now + until - wall_now)
+        self._unhealthy = frozenset(unhealthy)
+        self._next_expiry = next_expiry
+
+
+# The registry shared by every router in this process
+registry = HealthRegistry()
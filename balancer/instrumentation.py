@@ -0,0 +1,119 @@
+"""
+Per-query observation through Django's connection execute wrappers.
+
+Features that need to know how queries on each alias are going, such as
+health tracking, register an observer with ``add_observer``.  A single
+ExecuteWrapper is installed on every connection as it is created and reports
+the start and end of each query to the registered observers, and each
+successful write to the observers that ask for them.
+"""
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_observers = ()
+_writers = ()
+_lock = threading.Lock()
+
+
+# The statements that count as writes
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def is_write(sql):
+    """Check whether ``sql`` is an INSERT, UPDATE, DELETE or REPLACE."""
+    return (isinstance(sql, str) and
+            sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS))
+
+
+class QueryObserver(object):
+    """Base class for query observers.  The hooks must be cheap."""
+
+    # Whether write_succeeded should be called
+    observes_writes = False
+
+    def query_started(self, alias):
+        pass
+
+    def query_finished(self, alias, duration, error):
+        """
+        Called when a query on ``alias`` completes, after ``duration``
+        seconds.  ``error`` is the exception raised, or None on success.
+        """
+        pass
+
+    def write_succeeded(self, alias, sql):
+        """
+        Called when a write on ``alias`` succeeds, if ``observes_writes`` is
+        set.  The write may still be rolled back.
+        """
+        pass
+
+
+class ExecuteWrapper(object):
+    """The execute wrapper that reports queries to the observers."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        observers = _observers
+        writers = _writers
+        alias = self.alias
+        for observer in observers:
+            observer.query_started(alias)
+        start = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        except Exception as e:
+            duration = time.perf_counter() - start
+            for observer in observers:
+                observer.query_finished(alias, duration, e)
+            raise
+        duration = time.perf_counter() - start
+        for observer in observers:
+            observer.query_finished(alias, duration, None)
+        if writers and is_write(sql):
+            for observer in writers:
+                observer.write_succeeded(alias, sql)
+        return result
+
+
+def install_wrapper(connection, **kwargs):
+    """Add the ExecuteWrapper to a connection, if it isn't there already."""
+    for wrapper in connection.execute_wrappers:
+        if isinstance(wrapper, ExecuteWrapper):
+            return
+    connection.execute_wrappers.append(ExecuteWrapper(connection.alias))
+
+
+def _connection_created(sender, connection, **kwargs):
+    install_wrapper(connection)
+
+
+def add_observer(observer):
+    """
+    Register an observer, and start wrapping connections if this is the first
+    one.  Adding the same observer twice has no effect.
+    """
+    global _observers, _writers
+    with _lock:
+        if observer in _observers:
+            return
+        _observers = _observers + (observer,)
+        if observer.observes_writes:
+            _writers = _writers + (observer,)
+        connection_created.connect(_connection_created,
+                                   dispatch_uid='balancer.instrumentation')
+    for connection in connections.all():
+        if connection.connection is not None:
+            install_wrapper(connection)
+
+
+def remove_observer(observer):
+    global _observers, _writers
+    with _lock:
+        _observers = tuple(o for o in _observers if o is not observer)
+        _writers = tuple(o for o in _writers if o is not observer)
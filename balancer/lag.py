@@ -0,0 +1,202 @@
+"""
+Replication lag measurement for the LagAwareMixin.
+
+A probe reports how many seconds a database is behind the master, or None if
+that can't be determined because the database isn't a replica.  Probes are
+only consulted by a LagMonitor, once per interval from a thread of its own, so
+routing never waits for a replica that is down or slow.
+"""
+import os
+import threading
+import time
+import weakref
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+
+def get_probe():
+    """Instantiate the probe named in the DATABASE_POOL_LAG_PROBE setting."""
+    from django.conf import settings
+    path = getattr(settings, 'DATABASE_POOL_LAG_PROBE',
+                   'balancer.lag.DatabaseLagProbe')
+    return import_string(path)()
+
+
+class BaseLagProbe(object):
+    """Subclasses must implement get_lag."""
+
+    def get_lag(self, alias):
+        """Return the replication lag of ``alias`` in seconds, or None."""
+        raise NotImplementedError
+
+
+class MemoryLagProbe(BaseLagProbe):
+    """
+    A probe that reports lags set by hand, for tests and local development.
+    Aliases that were never set report no lag.
+    """
+    lags = {}
+
+    @classmethod
+    def set_lag(cls, alias, seconds):
+        cls.lags[alias] = seconds
+
+    @classmethod
+    def reset(cls):
+        cls.lags.clear()
+
+    def get_lag(self, alias):
+        return self.lags.get(alias)
+
+
+class PostgreSQLLagProbe(BaseLagProbe):
+    """
+    Measures how long ago the last replayed transaction was committed.  A
+    replica that has replayed everything it received reports no lag, so an
+    idle master doesn't make its replicas look stale.
+    """
+    sql = (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()"
+        " THEN 0 ELSE EXTRACT(EPOCH FROM now() - "
+        "pg_last_xact_replay_timestamp()) END"
+    )
+
+    def get_lag(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(self.sql)
+            row = cursor.fetchone()
+        if row is None or row[0] is None:
+            return None
+        return float(row[0])
+
+
+class MySQLLagProbe(BaseLagProbe):
+    """Reads Seconds_Behind_Master (or Seconds_Behind_Source) from MySQL."""
+    columns = ('Seconds_Behind_Source', 'Seconds_Behind_Master')
+
+    def get_lag(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SHOW SLAVE STATUS')
+            row = cursor.fetchone()
+            names = [column[0] for column in cursor.description or ()]
+        if row is None:
+            return None
+        status = dict(zip(names, row))
+        for column in self.columns:
+            if status.get(column) is not None:
+                return float(status[column])
+        # The replication threads aren't running, so lag is unbounded.
+        return float('inf')
+
+
+class DatabaseLagProbe(BaseLagProbe):
+    """
+    Dispatches to the probe for each database's vendor.  Databases without a
+    probe, such as SQLite, report no lag.
+    """
+    vendor_probes = {
+        'postgresql': PostgreSQLLagProbe,
+        'mysql': MySQLLagProbe,
+    }
+
+    def __init__(self):
+        self.probes = {}
+
+    def get_lag(self, alias):
+        probe = self.probes.get(alias)
+        if probe is None:
+            probe_class = self.vendor_probes.get(connections[alias].vendor)
+            if probe_class is None:
+                return None
+            probe = self.probes[alias] = probe_class()
+        return probe.get_lag(alias)
+
+
+class LagMonitor(object):
+    """
+    Tracks which aliases are lagging.  A daemon thread, started on the first
+    call to get_lagging in each process, probes every alias once per
+    interval on connections of its own; get_lagging only returns the last
+    result, which is empty until the first probe finishes.
+    """
+
+    def __init__(self, aliases, probe, max_lag=5, interval=1):
+        self.aliases = tuple(aliases)
+        self.probe = probe
+        self.max_lag = max_lag
+        self.interval = interval
+        self.lags = {}
+        self.lagging = frozenset()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        _monitors.add(self)
+
+    def get_lagging(self):
+        """Return a frozenset of the aliases that are currently lagging."""
+        if not self._started:
+            self.start()
+        return self.lagging
+
+    def start(self):
+        """Start the thread that probes the aliases, if it isn't running."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        thread = threading.Thread(target=_run, args=(weakref.ref(self),),
+                                  name='balancer-lag-monitor')
+        thread.daemon = True
+        thread.start()
+
+    def check(self):
+        """Probe every alias and update the set of lagging aliases."""
+        with self._lock:
+            lags = {}
+            for alias in self.aliases:
+                try:
+                    lags[alias] = self.probe.get_lag(alias)
+                except Exception:
+                    # A replica that can't report its lag can't be trusted.
+                    lags[alias] = float('inf')
+                    # Connect again for the next probe.
+                    try:
+                        connections[alias].close()
+                    except Exception:
+                        pass
+            self.lags = lags
+            self.lagging = frozenset(
+                alias for alias, lag in lags.items()
+                if lag is not None and lag > self.max_lag
+            )
+
+
+_monitors = weakref.WeakSet()
+
+
+def _run(ref):
+    # Hold the monitor only while probing, so the thread ends with it.
+    while True:
+        monitor = ref()
+        if monitor is None:
+            return
+        try:
+            monitor.check()
+        except Exception:
+            pass
+        interval = max(monitor.interval, 0.01)
+        del monitor
+        time.sleep(interval)
+
+
+def _after_fork_in_child():
+    # The monitor threads don't survive a fork.
+    for monitor in list(_monitors):
+        monitor._started = False
+        monitor._start_lock = threading.Lock()
+        monitor._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,53 @@
+"""
+Tracking of query latency on each alias, for the LatencyRouter.
+"""
+from balancer.instrumentation import QueryObserver
+from balancer.shared import SharedLatency
+
+
+class LatencyTracker(QueryObserver):
+    """
+    Keeps an exponentially weighted moving average of the query latency on
+    each alias in this process.  ``decay`` is the weight given to each new
+    sample.  Updates don't take a lock, so a sample can occasionally be lost
+    to a concurrent update, which doesn't matter for an average.  Once
+    shared, every process using the shared state keeps the same averages.
+    """
+
+    def __init__(self, decay=0.1):
+        self.decay = decay
+        self.ewma = {}
+        self.shared = None
+
+    def share(self, state):
+        """Keep the averages in a SharedState."""
+        if self.shared is not state:
+            self.shared = state
+            self.ewma = SharedLatency(state)
+
+    def query_finished(self, alias, duration, error):
+        # Failures are often fast, and shouldn't make a database look good.
+        if error is not None:
+            return
+        self.record(alias, duration)
+
+    def record(self, alias, duration):
+        average = self.ewma.get(alias)
+        if average is None:
+            self.ewma[alias] = duration
+        else:
+            self.ewma[alias] = average + self.decay * (duration - average)
+
+    def get_latency(self, alias):
+        """The average latency of ``alias``, or 0 if it hasn't been used."""
+        return self.ewma.get(alias, 0.0)
+
+    def reset(self):
+        if self.shared is not None:
+            self.shared.clear_latency()
+        else:
+            self.ewma = {}
+
+
+# The tracker shared by every router in this process
+tracker = LatencyTracker()
@@ -0,0 +1,91 @@
+"""
+Tracking of the queries in flight on each alias, for the LeastBusyRouter and
+for draining databases.
+"""
+import threading
+
+from django.db import connections
+
+from balancer.instrumentation import QueryObserver
+from balancer.shared import SharedInFlight
+
+
+class LoadTracker(QueryObserver):
+    """
+    Counts the queries currently executing on each alias in this process,
+    and, separately, the connections left in a transaction by their last
+    query on it.  A transaction stops counting once it is seen to have
+    ended: on the next query on the alias, at the end of a request, or when
+    ``end_transactions`` is called.  The counts can be read without the
+    lock.  Once shared, ``in_flight`` counts the queries of every process
+    using the shared state.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.in_flight = self.counts
+        self.shared = None
+        # The connections in a transaction on each alias
+        self.transactions = {}
+
+    def share(self, state):
+        """Publish the counts to a SharedState, and read them from it."""
+        if self.shared is not state:
+            self.shared = state
+            self.in_flight = SharedInFlight(state, self.counts)
+
+    def query_started(self, alias):
+        with self._lock:
+            count = self.counts[alias] = self.counts.get(alias, 0) + 1
+            if self.shared is not None:
+                self.shared.set_in_flight(alias, count)
+
+    def query_finished(self, alias, duration, error):
+        in_transaction = connections[alias].in_atomic_block
+        with self._lock:
+            count = self.counts[alias] = self.counts.get(alias, 1) - 1
+            if self.shared is not None:
+                self.shared.set_in_flight(alias, count)
+            transactions = self.transactions.get(alias)
+            if transactions:
+                self._end_transactions(alias, transactions)
+            if in_transaction:
+                connection = connections[alias]
+                if transactions is None:
+                    transactions = self.transactions[alias] = set()
+                if connection not in transactions:
+                    transactions.add(connection)
+                    self._publish_transactions(alias, transactions)
+
+    def _end_transactions(self, alias, transactions):
+        ended = [c for c in transactions if not c.in_atomic_block]
+        if ended:
+            transactions.difference_update(ended)
+            self._publish_transactions(alias, transactions)
+
+    def _publish_transactions(self, alias, transactions):
+        if self.shared is not None:
+            self.shared.set_transactions(alias, len(transactions))
+
+    def end_transactions(self):
+        """Stop counting the transactions that have ended."""
+        if not any(self.transactions.values()):
+            return
+        with self._lock:
+            for alias, transactions in self.transactions.items():
+                self._end_transactions(alias, transactions)
+
+    def get_in_flight(self, alias):
+        return self.in_flight.get(alias, 0)
+
+    def get_transactions(self, alias):
+        """Return the number of open transactions on ``alias``."""
+        count = len(self.transactions.get(alias, ()))
+        if self.shared is not None:
+            count += self.shared.get_other_transactions().get(alias, 0)
+        return count
+
+
+# The tracker shared by every router in this process
+tracker = LoadTracker()
@@ -0,0 +1,99 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from balancer import drain
+from balancer.reload import read_pool_file, write_pool_file
+
+
+class Command(BaseCommand):
+    help = ("Change the database pool of every running process by writing "
+            "the file named in the DATABASE_POOL_FILE setting.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'databases', nargs='*', metavar='alias[=weight]',
+            help="The databases in the new pool, with optional weights.  "
+                 "Without any, the current pool is kept.")
+        parser.add_argument(
+            '--master', help="A new master database.")
+        parser.add_argument(
+            '--drain', action='append', default=[], metavar='alias',
+            help="Stop new requests from using a database.")
+        parser.add_argument(
+            '--undrain', action='append', default=[], metavar='alias',
+            help="Let new requests use a drained database again.")
+        parser.add_argument(
+            '--wait', action='store_true',
+            help="Wait until no process on this host has queries running or "
+                 "transactions open on the drained databases.  Requires the "
+                 "DATABASE_POOL_SHARED_STATE setting.")
+        parser.add_argument(
+            '--timeout', type=float, default=None,
+            help="Give up waiting after this many seconds.")
+        parser.add_argument(
+            '--show', action='store_true',
+            help="Show the pool in the file instead of changing it.")
+
+    def check_alias(self, alias):
+        if alias not in settings.DATABASES:
+            raise CommandError("%r is not in DATABASES." % alias)
+
+    def handle(self, *args, **options):
+        path = getattr(settings, 'DATABASE_POOL_FILE', None)
+        if path is None:
+            raise CommandError("The DATABASE_POOL_FILE setting is not set.")
+        if options['wait'] and getattr(
+                settings, 'DATABASE_POOL_SHARED_STATE', None) is None:
+            raise CommandError(
+                "--wait needs the DATABASE_POOL_SHARED_STATE setting to see "
+                "the queries of other processes.")
+
+        if os.path.exists(path):
+            pool, master, draining = read_pool_file(path)
+        else:
+            pool, master, draining = settings.DATABASE_POOL, None, []
+
+        if options['show']:
+            for alias in pool:
+                weight = pool[alias] if isinstance(pool, dict) else 1
+                self.stdout.write('%s=%s' % (alias, weight))
+            if master is not None:
+                self.stdout.write('master: %s' % master)
+            for alias in draining:
+                self.stdout.write('draining: %s' % alias)
+            return
+
+        if options['databases']:
+            pool = {}
+            for database in options['databases']:
+                alias, _, weight = database.partition('=')
+                self.check_alias(alias)
+                try:
+                    pool[alias] = int(weight or 1)
+                except ValueError:
+                    raise CommandError("%r is not a valid weight." % weight)
+        if options['master'] is not None:
+            self.check_alias(options['master'])
+            master = options['master']
+        draining = set(draining)
+        for alias in options['drain']:
+            self.check_alias(alias)
+            draining.add(alias)
+        draining.difference_update(options['undrain'])
+
+        write_pool_file(path, pool, master, draining)
+        self.stdout.write("Wrote the new pool to %s." % path)
+
+        if options['wait'] and options['drain']:
+            # Give every process time to notice the file.
+            time.sleep(getattr(settings, 'DATABASE_POOL_FILE_INTERVAL', 5))
+            drain.install_tracker()
+            for alias in options['drain']:
+                if not drain.wait_until_idle(alias, options['timeout']):
+                    raise CommandError(
+                        "%r still has queries or transactions running." %
+                        alias)
+                self.stdout.write("%s is idle." % alias)
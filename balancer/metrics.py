@@ -0,0 +1,158 @@
+"""
+Routing metrics.
+
+When the DATABASE_POOL_METRICS setting is on, every pool router counts the
+reads and writes it sends to each database, the reads it pins to the master,
+and how long each routing decision takes.  Each thread records into its own
+shard without taking a lock, and the shards are only added up on export.
+When a thread exits, its shard is added to the totals of the exited threads,
+so servers that start a thread per request don't keep a shard for each.
+"""
+import threading
+import time
+import weakref
+
+# Upper bounds of the routing time histogram buckets, in seconds
+BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+           0.0001, 0.00025, 0.0005, 0.001, 0.01)
+
+
+class Shard(object):
+    """The metrics recorded by a single thread."""
+
+    def __init__(self):
+        self.counts = {'read': {}, 'write': {}, 'pinned': {}}
+        self.buckets = {'read': [0] * (len(BUCKETS) + 1),
+                        'write': [0] * (len(BUCKETS) + 1)}
+        self.sums = {'read': 0.0, 'write': 0.0}
+
+    def add(self, other):
+        """Add the metrics of another shard to this one."""
+        for name, counts in other.counts.items():
+            own = self.counts[name]
+            for alias, count in list(counts.items()):
+                own[alias] = own.get(alias, 0) + count
+        for operation, buckets in other.buckets.items():
+            own = self.buckets[operation]
+            for i, count in enumerate(buckets):
+                own[i] += count
+            self.sums[operation] += other.sums[operation]
+
+
+class ThreadShard(object):
+    """Holds a thread's shard in a thread local, which drops it on exit."""
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+def escape(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._exited = Shard()
+
+    def get_shard(self):
+        try:
+            return self._local.holder.shard
+        except AttributeError:
+            shard = Shard()
+            holder = self._local.holder = ThreadShard(shard)
+            weakref.finalize(holder, self._retire, shard)
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            try:
+                self._shards.remove(shard)
+            except ValueError:
+                # Recorded before a reset.
+                return
+            self._exited.add(shard)
+
+    def record(self, operation, alias, seconds):
+        shard = self.get_shard()
+        counts = shard.counts[operation]
+        counts[alias] = counts.get(alias, 0) + 1
+        shard.sums[operation] += seconds
+        buckets = shard.buckets[operation]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+                return
+        buckets[-1] += 1
+
+    def record_pinned_read(self, alias):
+        counts = self.get_shard().counts['pinned']
+        counts[alias] = counts.get(alias, 0) + 1
+
+    def observe(self, operation, method):
+        """Wrap a router's db_for_read or db_for_write method."""
+        record = self.record
+        clock = time.perf_counter
+
+        def observed(model, **hints):
+            start = clock()
+            alias = method(model, **hints)
+            record(operation, alias, clock() - start)
+            return alias
+        return observed
+
+    def snapshot(self):
+        """Add up the shards of every thread into a single Shard."""
+        total = Shard()
+        with self._lock:
+            shards = list(self._shards)
+            total.add(self._exited)
+        for shard in shards:
+            total.add(shard)
+        return total
+
+    def export_text(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        total = self.snapshot()
+        lines = []
+        for name, help_text in (
+                ('read', 'Reads routed to each database.'),
+                ('write', 'Writes routed to each database.'),
+                ('pinned', 'Reads pinned to the master after a write.')):
+            metric = 'balancer_%s_total' % (
+                'pinned_reads' if name == 'pinned' else name + 's')
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s counter' % metric)
+            for alias in sorted(total.counts[name]):
+                lines.append('%s{database="%s"} %d' % (
+                    metric, escape(alias), total.counts[name][alias]))
+
+        metric = 'balancer_routing_seconds'
+        lines.append('# HELP %s Time taken to choose a database.' % metric)
+        lines.append('# TYPE %s histogram' % metric)
+        for operation in ('read', 'write'):
+            cumulative = 0
+            buckets = total.buckets[operation]
+            for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append('%s_bucket{operation="%s",le="%s"} %d' % (
+                    metric, operation, bound, cumulative))
+            lines.append('%s_sum{operation="%s"} %r' % (
+                metric, operation, total.sums[operation]))
+            lines.append('%s_count{operation="%s"} %d' % (
+                metric, operation, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+# The metrics shared by every router in this process
+registry = Metrics()
@@ -1,8 +1,12 @@
+import time
 from datetime import datetime, timedelta
 
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async,
+)
 from django.conf import settings
 
-from balancer import pinning
+from balancer import context, pinning
 
 
 # The name of the session variable or cookie used by the middleware
@@ -11,14 +15,107 @@ PINNING_KEY = getattr(settings, 'MASTER_PINNING_KEY', 'master_db_pinned')
 # The number of seconds to direct reads to the master database after a write
 PINNING_SECONDS = int(getattr(settings, 'MASTER_PINNING_SECONDS', 5))
 
+# The name of the session variable or cookie that holds the master's position
+POSITION_KEY = getattr(settings, 'MASTER_POSITION_KEY', 'master_db_position')
 
-class PinningSessionMiddleware(object):
+# The number of seconds to keep the master's position after a write
+POSITION_SECONDS = int(getattr(settings, 'MASTER_POSITION_SECONDS', 60))
+
+# The name of the session variable or cookie that holds the pinned models
+PINNING_MODELS_KEY = getattr(settings, 'MASTER_PINNING_MODELS_KEY',
+                             'master_db_pinned_models')
+
+
+class PinningMiddlewareBase(object):
+    """
+    Adapts the process_request/process_response hooks of the pinning
+    middleware to the MIDDLEWARE setting.  The classes can still be listed in
+    MIDDLEWARE_CLASSES, where they are instantiated without arguments.
+
+    Each request runs in its own request scope, which makes the pool routers
+    read from a single slave for the whole request.
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = context.begin_scope()
+        try:
+            self.process_request(request)
+            response = self.get_response(request)
+            return self.process_response(request, response)
+        finally:
+            context.end_scope(token)
+
+    def process_request(self, request):
+        pass
+
+    def process_response(self, request, response):
+        return response
+
+
+class AsyncPinningMiddlewareBase(PinningMiddlewareBase):
+    """
+    An async-capable variant of PinningMiddlewareBase.  Pinning state lives in
+    context variables, so requests served concurrently on one event loop never
+    see each other's pins.
+    """
+    sync_capable = True
+    async_capable = True
+
+    # Whether the hooks may block, e.g. on a database-backed session.
+    hooks_block = False
+
+    def __init__(self, get_response=None):
+        super(AsyncPinningMiddlewareBase, self).__init__(get_response)
+        self.is_async = (get_response is not None and
+                         iscoroutinefunction(get_response))
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super(AsyncPinningMiddlewareBase, self).__call__(request)
+
+    async def __acall__(self, request):
+        token = context.begin_scope()
+        try:
+            return await self.handle(request)
+        finally:
+            context.end_scope(token)
+
+    async def handle(self, request):
+        # Context variables set in a worker thread are copied back to the
+        # calling context by sync_to_async.
+        if self.hooks_block:
+            await sync_to_async(self.process_request)(request)
+        else:
+            self.process_request(request)
+        response = await self.get_response(request)
+        if self.hooks_block:
+            return await sync_to_async(self.process_response)(request,
+                                                              response)
+        return self.process_response(request, response)
+
+
+class StickyMiddleware(AsyncPinningMiddlewareBase):
+    """
+    Runs each request in a request scope, so that the pool routers read from
+    a single slave for the whole request.  The pinning and causal middleware
+    already do this, so this is only needed without them.
+    """
+    pass
+
+
+class PinningSessionMiddleware(PinningMiddlewareBase):
     """
     Middleware to support the PinningMixin.  Sets a session variable if
     there was a database write, which will direct that user's subsequent reads
     to the master database.
     """
-    
+
     def process_request(self, request):
         """
         Set the thread's pinning flag according to the presence of the session
@@ -27,44 +124,190 @@ class PinningSessionMiddleware(object):
         pinned_until = request.session.get(PINNING_KEY, False)
         if pinned_until and pinned_until > datetime.now():
             pinning.pin_thread()
-        
+
+        pinned_models = request.session.get(PINNING_MODELS_KEY)
+        if pinned_models:
+            now = time.time()
+            pinning.pin_models(label for label, until in pinned_models.items()
+                               if until > now)
+
     def process_response(self, request, response):
         """
         If there was a write to the db, set the session variable to enable
         pinning.  If the variable already exists, the time will be reset.
+        Models written to are pinned on their own, with the expiry time
+        stored as a timestamp for each model.
         """
         if pinning.db_was_written():
             pinned_until = datetime.now() + timedelta(seconds=PINNING_SECONDS)
             request.session[PINNING_KEY] = pinned_until
             pinning.clear_db_write()
+
+        written = pinning.models_written()
+        if written:
+            now = time.time()
+            pinned_models = dict(
+                (label, until) for label, until in
+                request.session.get(PINNING_MODELS_KEY, {}).items()
+                if until > now
+            )
+            for label in written:
+                pinned_models[label] = now + PINNING_SECONDS
+            request.session[PINNING_MODELS_KEY] = pinned_models
+            pinning.clear_model_writes()
         pinning.unpin_thread()
+        pinning.unpin_models()
         return response
 
 
-class PinningCookieMiddleware(object):
+class PinningCookieMiddleware(PinningMiddlewareBase):
     """
     Middleware to support the PinningMixin.  Sets a cookie if there was a
     database write, which will direct that user's subsequent reads to the
     master database.
     """
-    
+
     def process_request(self, request):
         """
         Set the thread's pinning flag according to the presence of the cookie.
         """
         if PINNING_KEY in request.COOKIES:
             pinning.pin_thread()
-    
+        if PINNING_MODELS_KEY in request.COOKIES:
+            pinning.pin_models(
+                request.COOKIES[PINNING_MODELS_KEY].split(','))
+
     def process_response(self, request, response):
         """
         If this is a POST request and there was a write to the db, set the
         cookie to enable pinning.  If the cookie already exists, the time will
-        be reset.
+        be reset.  Models written to are listed in a separate cookie, along
+        with any models that were already pinned.
         """
         if request.method == 'POST' and pinning.db_was_written():
             response.set_cookie(PINNING_KEY,
                                 value='y',
                                 max_age=PINNING_SECONDS)
             pinning.clear_db_write()
+        if request.method == 'POST' and pinning.models_written():
+            response.set_cookie(PINNING_MODELS_KEY,
+                                value=','.join(sorted(pinning.pinned_models())),
+                                max_age=PINNING_SECONDS)
+            pinning.clear_model_writes()
         pinning.unpin_thread()
+        pinning.unpin_models()
         return response
+
+
+class CausalMiddlewareBase(PinningMiddlewareBase):
+    """
+    Shared behavior for the causal middleware, which support the
+    CausalConsistencyMixin.
+    """
+
+    def __init__(self, get_response=None):
+        super(CausalMiddlewareBase, self).__init__(get_response)
+        from balancer.causal import get_provider
+        self.position_provider = get_provider()
+
+    def require_position(self, position):
+        """
+        Parse the ``position`` from the client once, so that reads in this
+        request only compare it with each slave's position.
+        """
+        try:
+            position = self.position_provider.parse_position(position)
+        except ValueError:
+            # A position that can't be checked is one no slave has replayed.
+            pinning.pin_thread()
+        else:
+            pinning.require_position(position)
+
+    def get_master_position(self):
+        """
+        Return the master's position after a write in this request, or None.
+        """
+        if not pinning.db_was_written():
+            return None
+        pinning.clear_db_write()
+        return self.position_provider.master_position(
+            settings.MASTER_DATABASE)
+
+
+class CausalSessionMiddleware(CausalMiddlewareBase):
+    """
+    Stores the master's replication position in the session after a write,
+    so that the user's subsequent reads only go to slaves that have caught up.
+    """
+
+    def process_request(self, request):
+        position = request.session.get(POSITION_KEY)
+        if position:
+            self.require_position(position[0])
+
+    def process_response(self, request, response):
+        position = self.get_master_position()
+        if position is not None:
+            request.session[POSITION_KEY] = (position,
+                                             time.time() + POSITION_SECONDS)
+        elif POSITION_KEY in request.session:
+            # Forget positions that every slave has long since replayed.
+            if request.session[POSITION_KEY][1] < time.time():
+                del request.session[POSITION_KEY]
+        pinning.clear_position()
+        pinning.unpin_thread()
+        return response
+
+
+class CausalCookieMiddleware(CausalMiddlewareBase):
+    """
+    Stores the master's replication position in a cookie after a write in a
+    POST request, so that the user's subsequent reads only go to slaves that
+    have caught up.
+    """
+
+    def process_request(self, request):
+        if POSITION_KEY in request.COOKIES:
+            self.require_position(request.COOKIES[POSITION_KEY])
+
+    def process_response(self, request, response):
+        if request.method == 'POST':
+            position = self.get_master_position()
+            if position is not None:
+                response.set_cookie(POSITION_KEY,
+                                    value=position,
+                                    max_age=POSITION_SECONDS)
+        pinning.clear_db_write()
+        pinning.clear_position()
+        pinning.unpin_thread()
+        return response
+
+
+class AsyncPinningSessionMiddleware(AsyncPinningMiddlewareBase,
+                                    PinningSessionMiddleware):
+    """
+    PinningSessionMiddleware for ASGI deployments and async views.  Session
+    access runs in a worker thread, since the session backend may block.
+    """
+    hooks_block = True
+
+
+class AsyncPinningCookieMiddleware(AsyncPinningMiddlewareBase,
+                                   PinningCookieMiddleware):
+    """PinningCookieMiddleware for ASGI deployments and async views."""
+    pass
+
+
+class AsyncCausalSessionMiddleware(AsyncPinningMiddlewareBase,
+                                   CausalSessionMiddleware):
+    """CausalSessionMiddleware for ASGI deployments and async views."""
+    hooks_block = True
+
+
+class AsyncCausalCookieMiddleware(AsyncPinningMiddlewareBase,
+                                  CausalCookieMiddleware):
+    """
+    CausalCookieMiddleware for ASGI deployments and async views.  Asking the
+    master for its position runs in a worker thread.
+    """
+    hooks_block = True
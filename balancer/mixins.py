@@ -1,3 +1,5 @@
+from django.core.exceptions import ImproperlyConfigured
+
 from balancer import pinning
 
 
@@ -9,19 +11,25 @@ class MasterSlaveMixin(object):
 
     def __init__(self):
         super(MasterSlaveMixin, self).__init__()
-        from django.conf import settings
-        self.master = settings.MASTER_DATABASE
+        if self.master is None:
+            raise ImproperlyConfigured(
+                "%s requires the MASTER_DATABASE setting." %
+                self.__class__.__name__)
 
     def db_for_write(self, model, **hints):
         """Send all writes to the master"""
         return self.master
 
+    def get_fallback_db(self):
+        """Read from the master when no slave is available"""
+        return self.master
+
     def allow_relation(self, obj1, obj2, **hints):
         """
         Allow any relation between two objects in the slave pool or the master.
         """
-        pool = self.pool + [self.master]
-        if obj1._state.db in pool and obj2._state.db in pool:
+        related = self.state.related
+        if obj1._state.db in related and obj2._state.db in related:
             return True
         return None
 
@@ -38,16 +46,195 @@ class PinningMixin(object):
     """
     A mixin that pins reads to the database defined in the MASTER_DATABASE
     setting for a pre-determined period of time after a write.  Requires the
-    PinningRouterMiddleware.
+    PinningRouterMiddleware.  With MASTER_PINNING_MODE set to ``'commit'``,
+    only committed writes pin.
     """
 
+    def __init__(self):
+        super(PinningMixin, self).__init__()
+        from balancer import writes
+        self.pin_on_commit = writes.pins_on_commit(self)
+
     def db_for_read(self, model, **hints):
-        from django.conf import settings
         if pinning.thread_is_pinned():
-            return settings.MASTER_DATABASE
+            if self.metrics is not None:
+                self.metrics.record_pinned_read(self.master)
+            return self.master
         return super(PinningMixin, self).db_for_read(model, **hints)
 
     def db_for_write(self, model, **hints):
-        pinning.set_db_write()
-        pinning.pin_thread()
+        if not self.pin_on_commit:
+            pinning.set_db_write()
+            pinning.pin_thread()
         return super(PinningMixin, self).db_for_write(model, **hints)
+
+
+class ModelPinningMixin(object):
+    """
+    A mixin that pins reads to the master after a write, like the
+    PinningMixin, but only for the models that were written.  Reads of other
+    models keep going to the pool.  Requires one of the pinning middleware
+    classes.  With MASTER_PINNING_MODE set to ``'commit'``, only committed
+    writes pin.
+    """
+
+    def __init__(self):
+        super(ModelPinningMixin, self).__init__()
+        from balancer import writes
+        self.pin_on_commit = writes.pins_on_commit(self)
+
+    def db_for_read(self, model, **hints):
+        if pinning.model_is_pinned(model._meta.label_lower):
+            if self.metrics is not None:
+                self.metrics.record_pinned_read(self.master)
+            return self.master
+        return super(ModelPinningMixin, self).db_for_read(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        if not self.pin_on_commit:
+            label = model._meta.label_lower
+            pinning.set_model_write(label)
+            if not pinning.model_is_pinned(label):
+                pinning.pin_models((label,))
+        return super(ModelPinningMixin, self).db_for_write(model, **hints)
+
+
+class CausalConsistencyMixin(object):
+    """
+    A mixin that replaces time-based pinning with replication positions.
+    After a write, the causal middleware stores the master's position for the
+    user, and their later reads only go to slaves that have replayed past it.
+    Reads fall back to the master when no slave has caught up yet.  Requires
+    one of the causal middleware classes.  With MASTER_PINNING_MODE set to
+    ``'commit'``, only committed writes count.
+    """
+
+    def __init__(self):
+        super(CausalConsistencyMixin, self).__init__()
+        from balancer import writes
+        from balancer.causal import get_provider
+        self.position_provider = get_provider()
+        self.pin_on_commit = writes.pins_on_commit(self)
+
+    def get_excluded(self):
+        excluded = super(CausalConsistencyMixin, self).get_excluded()
+        position = pinning.required_position()
+        if position is None:
+            return excluded
+        behind = []
+        for alias in self.pool:
+            if alias == self.master:
+                continue
+            try:
+                if self.position_provider.has_replayed(alias, position):
+                    continue
+            except Exception:
+                pass
+            behind.append(alias)
+        if behind:
+            return excluded | frozenset(behind)
+        return excluded
+
+    def db_for_read(self, model, **hints):
+        # Reads after a write in the same request go to the master.
+        if pinning.thread_is_pinned():
+            if self.metrics is not None:
+                self.metrics.record_pinned_read(self.master)
+            return self.master
+        return super(CausalConsistencyMixin, self).db_for_read(model,
+                                                               **hints)
+
+    def db_for_write(self, model, **hints):
+        if not self.pin_on_commit:
+            pinning.set_db_write()
+            pinning.pin_thread()
+        return super(CausalConsistencyMixin, self).db_for_write(model,
+                                                                **hints)
+
+
+class LagAwareMixin(object):
+    """
+    A mixin that excludes databases from the pool while their replication lag
+    is above the DATABASE_POOL_MAX_LAG setting, and adds them back once they
+    catch up.  Lag is measured by the probe named in DATABASE_POOL_LAG_PROBE,
+    once every DATABASE_POOL_LAG_INTERVAL seconds, from a background thread.
+    """
+
+    def __init__(self):
+        super(LagAwareMixin, self).__init__()
+        from django.conf import settings
+        from balancer.lag import LagMonitor, get_probe
+        self.lag_monitor = LagMonitor(
+            self.get_probed_aliases(),
+            get_probe(),
+            max_lag=getattr(settings, 'DATABASE_POOL_MAX_LAG', 5),
+            interval=getattr(settings, 'DATABASE_POOL_LAG_INTERVAL', 1),
+        )
+
+    def get_probed_aliases(self):
+        return [alias for alias in sorted(self.state.members)
+                if alias != self.master]
+
+    def set_pool(self, pool, master=None, pools=None, tiers=None):
+        super(LagAwareMixin, self).set_pool(pool, master, pools, tiers)
+        if hasattr(self, 'lag_monitor'):
+            self.lag_monitor.aliases = tuple(self.get_probed_aliases())
+
+    def get_excluded(self):
+        excluded = super(LagAwareMixin, self).get_excluded()
+        lagging = self.lag_monitor.get_lagging()
+        if lagging:
+            return excluded | lagging
+        return excluded
+
+
+class HealthCheckMixin(object):
+    """
+    A mixin that takes databases out of the pool while their circuit breaker
+    is open.  Circuits open after operational errors on queries, or straight
+    away when a connection can't be made, and are retried with exponential
+    backoff.  If every database in the pool is down, reads fall back to the
+    master.
+    """
+
+    def __init__(self):
+        super(HealthCheckMixin, self).__init__()
+        from django.conf import settings
+        from balancer import instrumentation, shared
+        from balancer.health import registry
+        state = shared.get_state()
+        if state is not None:
+            registry.share(state)
+        registry.configure(
+            failure_threshold=getattr(
+                settings, 'DATABASE_POOL_FAILURE_THRESHOLD', None),
+            backoff=getattr(settings, 'DATABASE_POOL_BACKOFF', None),
+            max_backoff=getattr(settings, 'DATABASE_POOL_MAX_BACKOFF', None),
+        )
+        self.health = registry
+        self.connect_check = getattr(settings, 'DATABASE_POOL_CONNECT_CHECK',
+                                     True)
+        instrumentation.add_observer(registry)
+
+    def get_excluded(self):
+        excluded = super(HealthCheckMixin, self).get_excluded()
+        unhealthy = self.health.get_unhealthy()
+        if unhealthy:
+            return excluded | unhealthy
+        return excluded
+
+    def select_db(self, name=None):
+        """
+        Make sure the selected database accepts connections, choosing again
+        if it doesn't.  Each failure trips that database's circuit, so this
+        gives up after trying every database in the pool once.
+        """
+        alias = super(HealthCheckMixin, self).select_db(name)
+        if not self.connect_check:
+            return alias
+        for attempt in range(len(self.pool)):
+            if (alias == self.master or
+                    self.health.check_connection(alias)):
+                return alias
+            alias = super(HealthCheckMixin, self).select_db(name)
+        return alias
@@ -1,39 +1,110 @@
-import threading
+"""
+Pinning state for the current request.
 
-_locals = threading.local()
+The flags are kept in context variables rather than thread locals, so that
+requests served concurrently on the same thread by an ASGI server each see
+their own state.  Under WSGI every thread has its own context, which gives
+the same behavior as a thread local.
+"""
+from contextvars import ContextVar
+
+_pinned = ContextVar('balancer_pinned', default=False)
+_db_write = ContextVar('balancer_db_write', default=False)
+_pinned_models = ContextVar('balancer_pinned_models', default=frozenset())
+_written_models = ContextVar('balancer_written_models', default=frozenset())
+_position = ContextVar('balancer_position', default=None)
 
 
 def pin_thread():
     """
     Mark this thread as 'pinned', so that future reads will temporarily go
-    to the master database for the current user.  
+    to the master database for the current user.
     """
-    _locals.pinned = True
+    _pinned.set(True)
 
 
 def unpin_thread():
     """
     Clear the 'pinned' flag so that future reads are distributed normally.
     """
-    if getattr(_locals, 'pinned', False):
-        del _locals.pinned
+    if _pinned.get():
+        _pinned.set(False)
 
 
 def thread_is_pinned():
     """Check whether the current thread is pinned."""
-    return getattr(_locals, 'pinned', False)
+    return _pinned.get()
 
 
 def set_db_write():
     """Indicate that the database was written to."""
-    _locals.db_write = True
+    _db_write.set(True)
 
 
 def clear_db_write():
-    if getattr(_locals, 'db_write', False):
-        del _locals.db_write
+    if _db_write.get():
+        _db_write.set(False)
 
 
 def db_was_written():
     """Check whether a database write was performed."""
-    return getattr(_locals, 'db_write', False)
+    return _db_write.get()
+
+
+def pin_models(labels):
+    """
+    Pin reads of the given models to the master database.  Models are
+    identified by their lowercased label, such as ``'auth.user'``.
+    """
+    _pinned_models.set(_pinned_models.get().union(labels))
+
+
+def unpin_models():
+    """Clear the pinned models so that their reads are distributed normally."""
+    if _pinned_models.get():
+        _pinned_models.set(frozenset())
+
+
+def model_is_pinned(label):
+    """Check whether reads of the model are pinned to the master."""
+    return label in _pinned_models.get()
+
+
+def pinned_models():
+    """Return a frozenset of the labels of the pinned models."""
+    return _pinned_models.get()
+
+
+def set_model_write(label):
+    """Indicate that the model's table was written to."""
+    written = _written_models.get()
+    if label not in written:
+        _written_models.set(written | frozenset([label]))
+
+
+def clear_model_writes():
+    if _written_models.get():
+        _written_models.set(frozenset())
+
+
+def models_written():
+    """Return a frozenset of the labels of the models that were written."""
+    return _written_models.get()
+
+
+def require_position(position):
+    """
+    Only read from slaves that have replayed up to the master's replication
+    ``position``, as returned by the position provider's parse_position.
+    """
+    _position.set(position)
+
+
+def clear_position():
+    if _position.get() is not None:
+        _position.set(None)
+
+
+def required_position():
+    """Return the replication position reads must see, or None."""
+    return _position.get()
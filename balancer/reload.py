@@ -0,0 +1,149 @@
+"""
+Changing the pool of running routers without restarting the process.
+
+Every pool router registers itself here.  ``set_pool`` swaps a new pool into
+all of them, and is driven by Django's ``setting_changed`` signal and by the
+file named in the DATABASE_POOL_FILE setting, which the ``set_database_pool``
+management command writes.  Each process notices a change to the file within
+DATABASE_POOL_FILE_INTERVAL seconds.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from django.core.signals import setting_changed
+
+from balancer import drain
+from balancer.selection import normalize_pool
+
+logger = logging.getLogger('balancer.reload')
+
+_routers = weakref.WeakSet()
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def register(router):
+    _routers.add(router)
+
+
+def set_pool(pool, master=None):
+    """
+    Swap ``pool`` into every router, along with a new master database if
+    ``master`` is given.  An empty pool raises ValueError before any router
+    is changed.
+    """
+    if not normalize_pool(pool):
+        raise ValueError("Cannot use an empty pool.")
+    for router in list(_routers):
+        router.set_pool(pool, master)
+
+
+def _setting_changed(setting, value, **kwargs):
+    if setting == 'DATABASE_POOL' and value is not None:
+        set_pool(value)
+    elif setting == 'DATABASE_POOLS':
+        for router in list(_routers):
+            router.set_pool(dict(router.state.weights), pools=value or {})
+    elif setting == 'DATABASE_POOL_POLICIES':
+        for router in list(_routers):
+            router.set_policies(value or {})
+    elif setting == 'DATABASE_POOL_TIERS':
+        for router in list(_routers):
+            router.set_pool(dict(router.state.weights), tiers=value or ())
+    elif setting == 'MASTER_DATABASE' and value is not None:
+        for router in list(_routers):
+            router.master = value
+
+
+setting_changed.connect(_setting_changed, dispatch_uid='balancer.reload')
+
+
+def read_pool_file(path):
+    """
+    Return the pool, the master database and the draining databases from a
+    pool file, a JSON object with a ``pool`` key and optional ``master`` and
+    ``draining`` keys.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    return config['pool'], config.get('master'), config.get('draining', [])
+
+
+def write_pool_file(path, pool, master=None, draining=()):
+    """Write a pool file, replacing any existing file in a single step."""
+    config = {'pool': pool}
+    if master is not None:
+        config['master'] = master
+    if draining:
+        config['draining'] = sorted(draining)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(config, f, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class PoolFileWatcher(object):
+    """
+    Checks the pool file for changes at most once per interval, from
+    whichever thread calls poll first.  Other threads don't wait for it.
+    """
+
+    def __init__(self, path, interval=5):
+        self.path = path
+        self.interval = interval
+        self.mtime = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+    def poll(self):
+        if time.monotonic() < self._next_check:
+            return
+        if not self._lock.acquire(False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            try:
+                pool, master, draining = read_pool_file(self.path)
+                set_pool(pool, master)
+                drain.set_draining(draining)
+            except Exception:
+                # Keep routing with the current pool rather than failing the
+                # query that happened to notice the change.
+                logger.exception("Could not load the pool from %r.",
+                                 self.path)
+        finally:
+            self._lock.release()
+
+
+def get_watcher():
+    """
+    Return the watcher for the DATABASE_POOL_FILE setting, shared by every
+    router, or None if the setting isn't used.
+    """
+    global _watcher
+    from django.conf import settings
+    path = getattr(settings, 'DATABASE_POOL_FILE', None)
+    if path is None:
+        return None
+    with _watcher_lock:
+        if _watcher is None or _watcher.path != path:
+            _watcher = PoolFileWatcher(
+                path, getattr(settings, 'DATABASE_POOL_FILE_INTERVAL', 5))
+        return _watcher
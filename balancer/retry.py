@@ -0,0 +1,165 @@
+"""
+Retrying failed reads on another database in the pool.
+
+When the DATABASE_POOL_RETRY_READS setting is on, a RetryWrapper is installed
+on every connection.  If a SELECT fails outside of a transaction because the
+connection is broken, the alias is marked as suspect by opening its circuit
+in the health registry, and the query is run once more on another
+database from the pool it was chosen from: the router's own pool, from the
+first tier with one when the pool has tiers, or the named pool of a
+``use_pool`` override or a routing policy.  When that pool has no other
+database, master/slave routers retry on the master.  The new database's
+cursor takes the place of the failed one, so the caller fetches the results
+as usual.  Reads from the master are never retried on a slave.  Queries
+that fail on a working connection, such as timeouts, lock waits and SQL
+errors, are not retried; the health registry only counts them as failures.
+"""
+import logging
+import random
+import weakref
+from contextvars import ContextVar
+
+from django.db import (
+    DatabaseError, InterfaceError, OperationalError, connections,
+)
+from django.db.backends.signals import connection_created
+
+from balancer import context
+from balancer.health import is_connection_failure, registry
+from balancer.mixins import MasterSlaveMixin
+
+logger = logging.getLogger('balancer.retry')
+
+_retrying = ContextVar('balancer_retrying', default=False)
+
+# Weak references to the routers with retries enabled, newest first
+_routers = []
+
+
+def is_read(sql):
+    """Check whether ``sql`` is a SELECT."""
+    return isinstance(sql, str) and sql.lstrip()[:6].upper() == 'SELECT'
+
+
+def get_routers():
+    routers = [ref() for ref in list(_routers)]
+    return [router for router in routers if router is not None]
+
+
+def get_chosen_pool(router, alias):
+    """
+    Return the scope key and the pool name, None for the router's own pool,
+    that ``router`` chose ``alias`` from.  The request scope knows best, then
+    a ``use_pool`` override, and otherwise the first pool with ``alias`` is
+    taken, starting with the router's own.
+    """
+    state = router.state
+    scope = context.get_scope()
+    if scope is not None:
+        for key, bound in scope.items():
+            if bound != alias:
+                continue
+            if key is router:
+                return key, None
+            if isinstance(key, tuple) and key[0] is router:
+                return key, key[1]
+    override = context.get_override()
+    if override is not None and override[0] == context.POOL:
+        name = override[1]
+        if name in state.pools and alias in dict(state.pools[name][0]):
+            return (router, name), name
+    if alias in dict(state.weights):
+        return router, None
+    for name, (weights, selector) in state.pools.items():
+        if alias in dict(weights):
+            return (router, name), name
+    return router, None
+
+
+def get_retry_db(alias):
+    """
+    Mark ``alias`` as suspect and return another database from the pool
+    that the newest router using it chose it from, the master on
+    master/slave routers if that pool has no other, or None.  A request scope
+    that selected ``alias`` moves to the new database.
+    """
+    for router in get_routers():
+        state = router.state
+        if alias not in state.members or alias == state.master:
+            continue
+        registry.trip(alias)
+        excluded = router.get_excluded() | registry.get_unhealthy()
+        key, name = get_chosen_pool(router, alias)
+        if name is not None:
+            pools = [state.pools[name][0]]
+        else:
+            # Prefer the first tier with another database, if there are
+            # tiers.
+            pools = [tier for tier, selector in state.tiers] or [
+                state.weights]
+        for pool_weights in pools:
+            weights = [(other, weight) for other, weight in pool_weights
+                       if other != alias and other not in excluded and
+                       weight > 0]
+            if weights:
+                retry_alias = random.choices(
+                    [other for other, weight in weights],
+                    [weight for other, weight in weights])[0]
+                break
+        else:
+            if not isinstance(router, MasterSlaveMixin):
+                return None
+            retry_alias = state.master
+        scope = context.get_scope()
+        if scope is not None and scope.get(key) == alias:
+            context.bind(scope, key, retry_alias)
+        return retry_alias
+    return None
+
+
+class RetryWrapper(object):
+    """The execute wrapper that retries failed reads."""
+
+    def __call__(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except (OperationalError, InterfaceError) as e:
+            connection = context['connection']
+            if (many or _retrying.get() or not is_read(sql) or
+                    connection.in_atomic_block or not connection.autocommit or
+                    not is_connection_failure(connection, e)):
+                raise
+            alias = get_retry_db(connection.alias)
+            if alias is None:
+                raise
+            token = _retrying.set(True)
+            try:
+                cursor = connections[alias].cursor()
+                result = cursor.execute(sql, params)
+            except DatabaseError:
+                raise e
+            finally:
+                _retrying.reset(token)
+            logger.warning("Read on %r failed with %r, retried on %r.",
+                           connection.alias, e, alias)
+            context['cursor'].cursor = cursor.cursor
+            return result
+
+
+def install_wrapper(connection, **kwargs):
+    """Add the RetryWrapper to a connection, if it isn't there already."""
+    for wrapper in connection.execute_wrappers:
+        if isinstance(wrapper, RetryWrapper):
+            return
+    # The retry goes first, so the query observers see the failure.
+    connection.execute_wrappers.insert(0, RetryWrapper())
+
+
+def enable(router):
+    """Retry the failed reads of the databases in ``router``'s pool."""
+    _routers[:] = [ref for ref in _routers if ref() is not None]
+    _routers.insert(0, weakref.ref(router))
+    connection_created.connect(install_wrapper, dispatch_uid='balancer.retry')
+    for connection in connections.all():
+        if connection.connection is not None:
+            install_wrapper(connection)
@@ -1,8 +1,74 @@
-import bisect
-import itertools
-import random
+import numbers
 
-from balancer.mixins import MasterSlaveMixin, PinningMixin
+from django.core.exceptions import ImproperlyConfigured
+
+from balancer import context, drain, reload
+from balancer.mixins import (
+    CausalConsistencyMixin, HealthCheckMixin, LagAwareMixin,
+    MasterSlaveMixin, ModelPinningMixin, PinningMixin,
+)
+from balancer.selection import (
+    LeastBusySelector, PowerOfTwoSelector, RendezvousSelector,
+    RoundRobinSelector, SmoothWeightedSelector, UniformSelector,
+    WeightedSelector, normalize_pool,
+)
+
+
+def check_pool(weights, master=None):
+    """
+    Raise ImproperlyConfigured unless every alias in the pool, and the master
+    if given, is in the DATABASES setting, and the weights are non-negative
+    numbers with at least one above zero.
+    """
+    from django.conf import settings
+    databases = settings.DATABASES
+    if not weights:
+        raise ImproperlyConfigured("The database pool is empty.")
+    for alias, weight in weights:
+        if alias not in databases:
+            raise ImproperlyConfigured(
+                "The database pool refers to %r, which is not in the "
+                "DATABASES setting." % (alias,))
+        if (isinstance(weight, bool) or
+                not isinstance(weight, numbers.Real) or weight < 0):
+            raise ImproperlyConfigured(
+                "The weight of %r in the database pool must be a "
+                "non-negative number, not %r." % (alias, weight))
+    if not any(weight > 0 for alias, weight in weights):
+        raise ImproperlyConfigured(
+            "Every database in the pool has a weight of zero.")
+    if master is not None and master not in databases:
+        raise ImproperlyConfigured(
+            "The master database %r is not in the DATABASES setting." %
+            (master,))
+
+
+class PoolState(object):
+    """
+    The compiled routing table of a router: the weights, frozensets of the
+    pools and of the pools plus the master for membership checks, the
+    selector for the full pool, the weights and selectors of the named pools
+    and of the tiers, and a cache of selectors for partial pools.
+    Reconfiguring a router replaces its table with a single assignment, so the
+    read path never needs a lock and never sees a half-updated pool.
+    """
+
+    def __init__(self, weights, selector, master=None, selectors=None,
+                 pools=None, tiers=()):
+        self.weights = weights
+        self.aliases = tuple(alias for alias, weight in weights)
+        self.pools = {} if pools is None else pools
+        self.tiers = tiers
+        self.members = frozenset(self.aliases).union(*(
+            (alias for alias, weight in pool_weights)
+            for pool_weights, pool_selector in self.pools.values()))
+        self.master = master
+        if master is None:
+            self.related = self.members
+        else:
+            self.related = self.members | frozenset([master])
+        self.selector = selector
+        self.selectors = {} if selectors is None else selectors
 
 
 class BasePoolRouter(object):
@@ -11,16 +77,354 @@ class BasePoolRouter(object):
     DATABASE_POOL setting.
     """
 
+    selector_class = UniformSelector
+
+    # The number of selectors for partial pools that are kept around
+    max_cached_selectors = 64
+
     def __init__(self):
         from django.conf import settings
-        if isinstance(settings.DATABASE_POOL, dict):
-            self.pool = settings.DATABASE_POOL.keys()
+        self.state = None
+        self.policy_config = getattr(settings, 'DATABASE_POOL_POLICIES', {})
+        self.set_pool(settings.DATABASE_POOL,
+                      getattr(settings, 'MASTER_DATABASE', None),
+                      getattr(settings, 'DATABASE_POOLS', {}),
+                      getattr(settings, 'DATABASE_POOL_TIERS', ()))
+        self.sticky = getattr(settings, 'DATABASE_POOL_STICKY', True)
+
+        if getattr(settings, 'DATABASE_POOL_FOLLOW_INSTANCE', True):
+            self.db_for_read = self.follow_instance(self.db_for_read)
+        self.db_for_read = self.apply_policies(self.db_for_read)
+        self.db_for_read = self.apply_overrides(self.db_for_read)
+
+        self.metrics = None
+        if getattr(settings, 'DATABASE_POOL_METRICS', False):
+            from balancer.metrics import registry
+            self.metrics = registry
+            self.db_for_read = registry.observe('read', self.db_for_read)
+            self.db_for_write = registry.observe('write', self.db_for_write)
+
+        if getattr(settings, 'DATABASE_POOL_RETRY_READS', False):
+            from balancer import retry
+            retry.enable(self)
+
+        drain.install_tracker()
+        self.watcher = reload.get_watcher()
+        reload.register(self)
+
+    def follow_instance(self, method):
+        """
+        Wrap a router's db_for_read method so that reads with an ``instance``
+        hint, such as related object lookups, go to the database the instance
+        was loaded from when it is in the pool.  The lookup then reuses the
+        connection that is already open and reads from the same database.
+        Excluded databases aren't followed, except for draining ones.
+        """
+        def db_for_read(model, **hints):
+            instance = hints.get('instance')
+            if instance is not None:
+                alias = instance._state.db
+                if alias in self.state.members and (
+                        alias not in self.get_excluded() or
+                        alias in drain.draining):
+                    return alias
+            return method(model, **hints)
+        return db_for_read
+
+    def apply_overrides(self, method):
+        """
+        Wrap a router's db_for_read method so that the overrides set with
+        ``balancer.use_master()``, ``balancer.use_pool()`` and
+        ``balancer.read_from_replica`` take precedence over pinning and
+        instance hints.
+        """
+        get_override = context.get_override
+
+        def db_for_read(model, **hints):
+            override = get_override()
+            if override is not None:
+                alias = self.route(override, model, **hints)
+                if alias is not None:
+                    return alias
+            return method(model, **hints)
+        return db_for_read
+
+    def apply_policies(self, method):
+        """
+        Wrap a router's db_for_read method so that reads of the apps and
+        models in the DATABASE_POOL_POLICIES setting go to the master or to
+        a named pool, ahead of pinning and instance hints.  A model's own
+        policy wins over its app's, and the ``'replica'`` policy routes reads
+        as usual, pinning included.
+        """
+        replica = context.REPLICA
+
+        def db_for_read(model, **hints):
+            policies = self.policies
+            if policies:
+                meta = model._meta
+                policy = (policies.get(meta.label_lower) or
+                          policies.get(meta.app_label))
+                if policy is not None and policy[0] != replica:
+                    alias = self.route(policy, model, **hints)
+                    if alias is not None:
+                        return alias
+            return method(model, **hints)
+        return db_for_read
+
+    def route(self, policy, model, **hints):
+        """
+        Return the database for a read under an override or a policy, a
+        ``(kind, name)`` pair, or None to route the read as usual.
+        """
+        kind, name = policy
+        if kind == context.POOL:
+            return self.select_db(name)
+        if kind == context.REPLICA:
+            return self.get_pool_db(model, **hints)
+        if kind == context.MASTER:
+            return self.master
+        return None
+
+    def set_policies(self, policies):
+        """
+        Replace the routing policies, a dict like the DATABASE_POOL_POLICIES
+        setting.  Raises ImproperlyConfigured for invalid policies.
+        """
+        table = self.build_policies(policies, self.state.pools, self.master)
+        self.policy_config = policies
+        self.policies = table
+
+    def build_policies(self, policies, pools, master):
+        """
+        Compile routing policies into a table keyed by app label and
+        lowercase model label.  Raises ImproperlyConfigured for a pool that
+        isn't in ``pools``, or for ``'master'`` without a master database.
+        """
+        table = {}
+        for label, target in policies.items():
+            if label.endswith('.*'):
+                label = label[:-2]
+            if '.' in label:
+                app_label, model_name = label.split('.', 1)
+                label = '%s.%s' % (app_label, model_name.lower())
+            if target == context.MASTER:
+                if master is None:
+                    raise ImproperlyConfigured(
+                        "The policy for %r requires the MASTER_DATABASE "
+                        "setting." % (label,))
+                table[label] = (context.MASTER, None)
+            elif target == context.REPLICA:
+                table[label] = (context.REPLICA, None)
+            elif target in pools:
+                table[label] = (context.POOL, target)
+            else:
+                raise ImproperlyConfigured(
+                    "The policy for %r uses %r, which is not a pool in "
+                    "DATABASE_POOLS." % (label, target))
+        return table
+
+    def set_pool(self, pool, master=None, pools=None, tiers=None):
+        """
+        Replace the pool, which can be a list of aliases or a dict mapping
+        aliases to their weights, like the DATABASE_POOL setting, and the
+        master database, the named pools and the tiers if given.  Queries that
+        already chose a database are not affected.  Raises
+        ImproperlyConfigured for an invalid pool or tiers, or when the routing
+        policies no longer fit the pools, leaving the router as it was.
+        """
+        weights = normalize_pool(pool)
+        if master is None and self.state is not None:
+            master = self.state.master
+        check_pool(weights, master)
+        if pools is None:
+            named = self.state.pools if self.state is not None else {}
+        else:
+            named = {}
+            for name, named_pool in pools.items():
+                named_weights = normalize_pool(named_pool)
+                check_pool(named_weights)
+                named[name] = (named_weights,
+                               self.build_selector(named_weights))
+        if tiers is None:
+            tier_aliases = self.tier_aliases
         else:
-            self.pool = list(settings.DATABASE_POOL)
+            tier_aliases = tuple(tuple(tier) for tier in tiers)
+        state = PoolState(weights, self.build_selector(weights), master,
+                          pools=named,
+                          tiers=self.build_tiers(weights, tier_aliases))
+        policies = self.build_policies(self.policy_config, named, master)
+        self.tier_aliases = tier_aliases
+        self.state = state
+        self.policies = policies
+        self.weights = state.weights
+        self.pool = list(state.aliases)
+        self.selector = state.selector
+
+    @property
+    def master(self):
+        """The master database, from the MASTER_DATABASE setting."""
+        return self.state.master
+
+    @master.setter
+    def master(self, alias):
+        state = self.state
+        check_pool(state.weights, alias)
+        self.state = PoolState(state.weights, state.selector, alias,
+                               state.selectors, state.pools, state.tiers)
+
+    def build_selector(self, weights):
+        """
+        Return a selector for a tuple of ``(alias, weight)`` pairs, raising
+        ValueError if there is nothing to select from.
+        """
+        return self.selector_class(weights)
+
+    def get_excluded(self):
+        """
+        Return a frozenset of aliases that should not be selected right now,
+        starting with the draining databases.  Mixins extend this to take
+        lagging or failing databases out of the pool.
+        """
+        return drain.draining
+
+    def build_tiers(self, weights, tier_aliases):
+        """
+        Split the pool into tiers, like those of the DATABASE_POOL_TIERS
+        setting, returning a tuple of ``(weights, selector)`` pairs in order
+        of preference.  Databases in the pool that aren't in any tier make up
+        a last tier.  Without tiers, this returns an empty tuple.  Raises
+        ImproperlyConfigured when a tier uses a database outside the pool.
+        """
+        if not tier_aliases:
+            return ()
+        pool = dict(weights)
+        for tier in tier_aliases:
+            for alias in tier:
+                if alias not in pool:
+                    raise ImproperlyConfigured(
+                        "DATABASE_POOL_TIERS uses %r, which is not in the "
+                        "pool." % (alias,))
+        tiers = []
+        seen = set()
+        for tier in tier_aliases + (tuple(pool),):
+            tier_weights = tuple((alias, pool[alias]) for alias in tier
+                                 if alias not in seen)
+            seen.update(alias for alias, weight in tier_weights)
+            try:
+                tiers.append((tier_weights,
+                              self.build_selector(tier_weights)))
+            except ValueError:
+                pass
+        return tuple(tiers)
+
+    def get_pool(self, name=None):
+        """
+        Return the weights and the selector of the pool, or of the named pool
+        from the DATABASE_POOLS setting.
+        """
+        state = self.state
+        if name is None:
+            return state.weights, state.selector
+        try:
+            return state.pools[name]
+        except KeyError:
+            raise ImproperlyConfigured(
+                "There is no database pool named %r in the DATABASE_POOLS "
+                "setting." % (name,))
+
+    def get_selector(self, name=None):
+        """
+        Return the selector for the pool, or the named pool, minus any
+        excluded aliases, or None if every alias is excluded.  Selectors for
+        partial pools are built on first use and cached, so the common case
+        costs a dict lookup.
+        """
+        if self.watcher is not None:
+            self.watcher.poll()
+        state = self.state
+        excluded = self.get_excluded()
+        if name is None and state.tiers:
+            # Stay in the first tier with a database that isn't excluded.
+            for index, (weights, selector) in enumerate(state.tiers):
+                selector = self.exclude(state, weights, selector, excluded,
+                                        (index, excluded))
+                if selector is not None:
+                    return selector
+            return None
+        weights, selector = self.get_pool(name)
+        return self.exclude(state, weights, selector, excluded,
+                            excluded if name is None else (name, excluded))
+
+    def exclude(self, state, pool_weights, selector, excluded, key):
+        """
+        Return ``selector`` without the ``excluded`` aliases, building the
+        selector for the partial pool and caching it under ``key``.
+        """
+        if not excluded:
+            return selector
+        try:
+            return state.selectors[key]
+        except KeyError:
+            pass
+        weights = tuple((alias, weight) for alias, weight in pool_weights
+                        if alias not in excluded)
+        try:
+            selector = self.build_selector(weights)
+        except ValueError:
+            selector = None
+        if len(state.selectors) >= self.max_cached_selectors:
+            state.selectors.clear()
+        state.selectors[key] = selector
+        return selector
+
+    def get_fallback_db(self):
+        """
+        The database to use when every alias in the pool is excluded.  With
+        nowhere better to go, fall back to the full pool.
+        """
+        return self.state.selector.choice()
+
+    def choose_db(self, name=None):
+        selector = self.get_selector(name)
+        if selector is None:
+            if name is not None:
+                # A named pool has no master to fall back to.
+                return self.get_pool(name)[1].choice()
+            return self.get_fallback_db()
+        return selector.choice()
+
+    def select_db(self, name=None):
+        """
+        Choose a database from the pool, or the named pool.  Inside a request
+        scope, the database chosen first is reused for as long as it isn't
+        excluded from the pool.  Requests that already use a draining
+        database keep using it until they finish, while one whose database is
+        found unhealthy moves to another one.
+        """
+        if self.sticky:
+            scope = context.get_scope()
+            if scope is not None:
+                key = self if name is None else (self, name)
+                alias = scope.get(key)
+                if alias is None or (alias in self.get_excluded() and
+                                     alias not in drain.draining):
+                    alias = self.choose_db(name)
+                    context.bind(scope, key, alias)
+                return alias
+        return self.choose_db(name)
+
+    def get_pool_db(self, model, **hints):
+        """
+        Choose a database from the pool for a read that ignores pinning, as
+        in functions decorated with ``balancer.read_from_replica``.
+        """
+        return self.select_db()
 
     def allow_relation(self, obj1, obj2, **hints):
         """Allow any relation between two objects in the pool"""
-        if obj1._state.db in self.pool and obj2._state.db in self.pool:
+        members = self.state.members
+        if obj1._state.db in members and obj2._state.db in members:
             return True
         return None
 
@@ -43,7 +447,7 @@ class RandomRouter(BasePoolRouter):
         return self.get_random_db()
 
     def get_random_db(self):
-        return random.choice(list(self.pool))
+        return self.select_db()
 
 
 class WeightedRandomRouter(RandomRouter):
@@ -51,48 +455,141 @@ class WeightedRandomRouter(RandomRouter):
     A router that randomly selects from a weighted pool of databases, useful
     for replication configurations where all nodes act as masters.
     """
+    selector_class = WeightedSelector
 
-    def __init__(self):
-        from django.conf import settings
-        self.pool = settings.DATABASE_POOL.keys()
-        self.totals = []
 
-        weights = settings.DATABASE_POOL.values()
-        running_total = 0
+class RoundRobinRouter(BasePoolRouter):
+    """
+    A router that cycles over a pool of databases in order, evenly distributing
+    the load.
+    """
+    selector_class = RoundRobinSelector
 
-        for w in weights:
-            running_total += w
-            self.totals.append(running_total)
+    def db_for_read(self, model, **hints):
+        return self.get_next_db()
 
-    def get_random_db(self):
-        """Use binary search to find the index of the database to use"""
-        rnd = random.random() * self.totals[-1]
-        pool_index = bisect.bisect_right(self.totals, rnd)
-        return list(self.pool)[pool_index]
+    def db_for_write(self, model, **hints):
+        return self.get_next_db()
+
+    def get_next_db(self):
+        return self.select_db()
 
 
-class RoundRobinRouter(BasePoolRouter):
+class WeightedRoundRobinRouter(RoundRobinRouter):
     """
-    A router that cycles over a pool of databases in order, evenly distributing
-    the load.
+    A router that cycles over a weighted pool of databases, interleaving the
+    databases so that heavier weights never receive their share in bursts.
+    """
+    selector_class = SmoothWeightedSelector
+
+
+class LeastBusyRouter(BasePoolRouter):
+    """
+    A router that sends each query to the database with the fewest queries in
+    flight from this process, relative to its weight.
     """
 
     def __init__(self):
-        super(RoundRobinRouter, self).__init__()
+        from balancer import instrumentation, shared
+        from balancer.load import tracker
+        state = shared.get_state()
+        if state is not None:
+            tracker.share(state)
+        self.tracker = tracker
+        super(LeastBusyRouter, self).__init__()
+        instrumentation.add_observer(tracker)
+
+    def build_selector(self, weights):
+        return LeastBusySelector(weights, self.tracker)
+
+    def db_for_read(self, model, **hints):
+        return self.get_least_busy_db()
 
-        # Shuffle the pool so the first database isn't slammed during startup.
-        random.shuffle(list(self.pool))
+    def db_for_write(self, model, **hints):
+        return self.get_least_busy_db()
 
-        self.pool_cycle = itertools.cycle(self.pool)
+    def get_least_busy_db(self):
+        return self.select_db()
+
+
+class LatencyRouter(BasePoolRouter):
+    """
+    A router that keeps a moving average of the query latency on each
+    database, and sends each query to the faster of two databases drawn at
+    random by weight.
+    """
+
+    def __init__(self):
+        from django.conf import settings
+        from balancer import instrumentation, shared
+        from balancer.latency import tracker
+        decay = getattr(settings, 'DATABASE_POOL_LATENCY_DECAY', None)
+        if decay is not None:
+            tracker.decay = decay
+        state = shared.get_state()
+        if state is not None:
+            tracker.share(state)
+        self.tracker = tracker
+        super(LatencyRouter, self).__init__()
+        instrumentation.add_observer(tracker)
+
+    def build_selector(self, weights):
+        return PowerOfTwoSelector(weights, self.tracker)
 
     def db_for_read(self, model, **hints):
-        return self.get_next_db()
+        return self.get_fastest_db()
 
     def db_for_write(self, model, **hints):
-        return self.get_next_db()
+        return self.get_fastest_db()
 
-    def get_next_db(self):
-        return next(self.pool_cycle)
+    def get_fastest_db(self):
+        return self.select_db()
+
+
+class AffinityRouter(BasePoolRouter):
+    """
+    A router that uses rendezvous hashing to send queries with the same key
+    to the same database, so that each database's cache holds a share of the
+    working set instead of all of it.  The key is the affinity key of the
+    current context if one is set, otherwise the instance in the hints, and
+    otherwise the model.  When a database leaves the pool, only the keys that
+    went to it move elsewhere.
+    """
+    selector_class = RendezvousSelector
+
+    def get_affinity_key(self, model, **hints):
+        """Return the key to route by, or None to select by weight."""
+        key = context.get_affinity_key()
+        if key is not None:
+            return key
+        label = getattr(getattr(model, '_meta', None), 'label_lower', None)
+        instance = hints.get('instance')
+        if instance is not None and instance.pk is not None:
+            return '%s:%s' % (label, instance.pk)
+        return label
+
+    def db_for_read(self, model, **hints):
+        return self.get_affinity_db(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self.get_affinity_db(model, **hints)
+
+    def get_pool_db(self, model, **hints):
+        return self.get_affinity_db(model, **hints)
+
+    def get_affinity_db(self, model, **hints):
+        """
+        Choose the database for the key.  Request scopes are ignored, since
+        keys are stable on their own and a scope would send every model to
+        the first database chosen.
+        """
+        key = self.get_affinity_key(model, **hints)
+        if key is None:
+            return self.select_db()
+        selector = self.get_selector()
+        if selector is None:
+            return self.get_fallback_db()
+        return selector.choice_for(key)
 
 
 class WeightedMasterSlaveRouter(MasterSlaveMixin, WeightedRandomRouter):
@@ -103,6 +600,23 @@ class RoundRobinMasterSlaveRouter(MasterSlaveMixin, RoundRobinRouter):
     pass
 
 
+class WeightedRoundRobinMasterSlaveRouter(MasterSlaveMixin,
+                                         WeightedRoundRobinRouter):
+    pass
+
+
+class LeastBusyMasterSlaveRouter(MasterSlaveMixin, LeastBusyRouter):
+    pass
+
+
+class LatencyMasterSlaveRouter(MasterSlaveMixin, LatencyRouter):
+    pass
+
+
+class AffinityMasterSlaveRouter(MasterSlaveMixin, AffinityRouter):
+    pass
+
+
 class PinningWMSRouter(PinningMixin, WeightedMasterSlaveRouter):
     """A weighted master/slave router that uses the pinning mixin."""
     pass
@@ -111,3 +625,67 @@ class PinningWMSRouter(PinningMixin, WeightedMasterSlaveRouter):
 class PinningRRMSRouter(PinningMixin, RoundRobinMasterSlaveRouter):
     """A round-robin master/slave router that uses the pinning mixin."""
     pass
+
+
+class ModelPinningWMSRouter(ModelPinningMixin, WeightedMasterSlaveRouter):
+    """
+    A weighted master/slave router that pins reads of the models that were
+    written to.
+    """
+    pass
+
+
+class ModelPinningRRMSRouter(ModelPinningMixin, RoundRobinMasterSlaveRouter):
+    """
+    A round-robin master/slave router that pins reads of the models that were
+    written to.
+    """
+    pass
+
+
+class CausalWMSRouter(CausalConsistencyMixin, WeightedMasterSlaveRouter):
+    """
+    A weighted master/slave router that reads from slaves once they have
+    replayed the user's last write.
+    """
+    pass
+
+
+class CausalRRMSRouter(CausalConsistencyMixin, RoundRobinMasterSlaveRouter):
+    """
+    A round-robin master/slave router that reads from slaves once they have
+    replayed the user's last write.
+    """
+    pass
+
+
+class LagAwareWMSRouter(LagAwareMixin, WeightedMasterSlaveRouter):
+    """
+    A weighted master/slave router that stops reading from slaves that fall
+    too far behind the master.
+    """
+    pass
+
+
+class LagAwareRRMSRouter(LagAwareMixin, RoundRobinMasterSlaveRouter):
+    """
+    A round-robin master/slave router that stops reading from slaves that
+    fall too far behind the master.
+    """
+    pass
+
+
+class HealthCheckWMSRouter(HealthCheckMixin, WeightedMasterSlaveRouter):
+    """
+    A weighted master/slave router that moves reads away from slaves that are
+    failing.
+    """
+    pass
+
+
+class HealthCheckRRMSRouter(HealthCheckMixin, RoundRobinMasterSlaveRouter):
+    """
+    A round-robin master/slave router that moves reads away from slaves that
+    are failing.
+    """
+    pass
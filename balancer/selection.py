@@ -0,0 +1,358 @@
+"""
+Precompiled selection engines used by the pool routers.
+
+A selector is built once from the pool weights and then only answers
+``choice()``, so picking a database on the query path does not copy the pool.
+The uniform, weighted, round robin, smooth weighted and rendezvous selectors
+pick in constant time; the least busy selector looks at every alias.
+
+Round robin selectors start their cycle at an offset given by the worker id
+of the process, so that the workers of a pre-forking server don't all send
+their first queries to the same database.  Each process forked after this
+module is imported is numbered in turn, and takes that number as its worker
+id; otherwise the process id is used.  Servers can also set the worker id
+with ``set_worker_id``.
+"""
+import hashlib
+import itertools
+import math
+import os
+import random
+import weakref
+from fractions import Fraction
+
+_round_robin_selectors = weakref.WeakSet()
+_forks = 0
+_worker_id = None
+
+
+def get_worker_id():
+    """Return the worker id of this process, or its process id."""
+    if _worker_id is None:
+        return os.getpid()
+    return _worker_id
+
+
+def set_worker_id(worker_id):
+    """
+    Set the worker id of this process, for example from gunicorn's
+    ``post_fork`` hook, and restart every round robin cycle from its offset.
+    Passing None goes back to the process id.
+    """
+    global _worker_id
+    _worker_id = worker_id
+    for selector in list(_round_robin_selectors):
+        selector.restart()
+
+
+def _before_fork():
+    global _forks
+    _forks += 1
+
+
+def _after_fork_in_child():
+    set_worker_id(_forks)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork,
+                        after_in_child=_after_fork_in_child)
+
+
+def normalize_pool(pool):
+    """
+    Return an ordered ``(alias, weight)`` tuple for a DATABASE_POOL setting,
+    which can be either a list of aliases or a dict mapping aliases to their
+    weights.
+    """
+    if isinstance(pool, dict):
+        return tuple((alias, pool[alias]) for alias in pool)
+    return tuple((alias, 1) for alias in pool)
+
+
+class UniformSelector(object):
+    """Selects each alias with equal probability."""
+
+    def __init__(self, weights):
+        self.aliases = tuple(alias for alias, weight in weights)
+        if not self.aliases:
+            raise ValueError("Cannot select from an empty pool.")
+        self._choice = random.choice
+
+    def choice(self):
+        return self._choice(self.aliases)
+
+
+class WeightedSelector(object):
+    """
+    Selects an alias with probability proportional to its weight, using
+    Vose's alias method.  The probability and alias tables are built once, and
+    each selection costs a single call to ``random.random()``.
+    """
+
+    def __init__(self, weights):
+        weights = [(alias, weight) for alias, weight in weights if weight > 0]
+        if not weights:
+            raise ValueError("Cannot select from an empty pool.")
+
+        self.aliases = tuple(alias for alias, weight in weights)
+        count = len(weights)
+        total = float(sum(weight for alias, weight in weights))
+        scaled = [weight * count / total for alias, weight in weights]
+
+        prob = [1.0] * count
+        alias_index = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias_index[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+        # Anything left over is only short of 1.0 due to rounding error.
+        self.prob = tuple(prob)
+        self.alias_index = tuple(alias_index)
+        self.count = count
+        self._random = random.random
+
+    def choice(self):
+        r = self._random() * self.count
+        i = int(r)
+        if r - i < self.prob[i]:
+            return self.aliases[i]
+        return self.aliases[self.alias_index[i]]
+
+
+class RoundRobinSelector(object):
+    """
+    Cycles over a sequence of aliases that is computed once.  The position in
+    the cycle comes from ``itertools.count``, whose ``next()`` is atomic, so
+    concurrent threads never need a lock and never receive the same slot.
+    The cycle starts at the worker id of the process modulo the period, so
+    workers with consecutive ids start on consecutive slots of the whole
+    schedule, weighted turns included.
+    """
+
+    def __init__(self, weights):
+        weights = tuple(weights)
+        self.aliases = tuple(alias for alias, weight in weights)
+        if not self.aliases:
+            raise ValueError("Cannot select from an empty pool.")
+        self.sequence = tuple(self.build_sequence(weights))
+        self.period = len(self.sequence)
+        self.restart()
+        _round_robin_selectors.add(self)
+
+    def restart(self):
+        """Restart the cycle at the offset for this process."""
+        self._counter = itertools.count(get_worker_id() % self.period)
+
+    def build_sequence(self, weights):
+        return self.aliases
+
+    def choice(self):
+        return self.sequence[next(self._counter) % self.period]
+
+
+def _reduce(weights):
+    divisor = 0
+    for weight in weights:
+        divisor = math.gcd(divisor, weight)
+    return [weight // divisor for weight in weights]
+
+
+def integer_weights(weights, limit):
+    """
+    Return whole numbers in the same proportions as ``weights``, which can be
+    any positive numbers, reduced by their greatest common divisor.  Weights
+    that would still add up to more than ``limit`` are scaled down to about
+    ``limit``, keeping at least 1 for each.
+    """
+    # Fractions with small denominators, unless that rounds a weight to 0
+    fractions = [Fraction(weight).limit_denominator(limit) or Fraction(weight)
+                 for weight in weights]
+    denominator = 1
+    for fraction in fractions:
+        denominator = (denominator * fraction.denominator //
+                       math.gcd(denominator, fraction.denominator))
+    whole = _reduce([int(fraction * denominator) for fraction in fractions])
+    total = sum(whole)
+    if total > limit:
+        # Hand out the slots left after rounding down by largest remainder.
+        scaled = [max(1, weight * limit // total) for weight in whole]
+        order = sorted(range(len(whole)),
+                       key=lambda i: (whole[i] * limit) % total, reverse=True)
+        for i in order[:max(0, limit - sum(scaled))]:
+            scaled[i] += 1
+        whole = _reduce(scaled)
+    return whole
+
+
+class SmoothWeightedSelector(RoundRobinSelector):
+    """
+    Weighted round robin using nginx's smooth algorithm, which interleaves the
+    heavier aliases with the lighter ones instead of sending them in bursts.
+    One full period of the schedule is precomputed from whole-number weights,
+    reduced by their greatest common divisor and, for fractional or very
+    large weights, scaled to at most about ``max_period`` turns.
+    """
+
+    # The length of schedule that fractional or large weights are scaled to
+    max_period = 1024
+
+    def build_sequence(self, weights):
+        weights = [(alias, weight) for alias, weight in weights if weight > 0]
+        if not weights:
+            raise ValueError("Cannot select from an empty pool.")
+
+        whole = integer_weights([weight for alias, weight in weights],
+                                self.max_period)
+        weights = list(zip([alias for alias, weight in weights], whole))
+        total = sum(whole)
+
+        current = [0] * len(weights)
+        sequence = []
+        for step in range(total):
+            best = 0
+            for i, (alias, weight) in enumerate(weights):
+                current[i] += weight
+                if current[i] > current[best]:
+                    best = i
+            current[best] -= total
+            sequence.append(weights[best][0])
+        return sequence
+
+
+class LeastBusySelector(object):
+    """
+    Selects the alias with the fewest queries in flight per unit of weight,
+    according to a LoadTracker.  The scan starts at a random position, so that
+    ties are broken randomly instead of always favoring the first alias.
+    """
+
+    def __init__(self, weights, tracker):
+        weights = [(alias, weight) for alias, weight in weights if weight > 0]
+        if not weights:
+            raise ValueError("Cannot select from an empty pool.")
+        self.aliases = tuple(alias for alias, weight in weights)
+        self.scales = tuple(1.0 / weight for alias, weight in weights)
+        self.count = len(weights)
+        self.tracker = tracker
+        self._random = random.random
+
+    def choice(self):
+        in_flight = self.tracker.in_flight
+        count = self.count
+        start = int(self._random() * count)
+        best = start
+        best_load = in_flight.get(self.aliases[start], 0) * self.scales[start]
+        for offset in range(1, count):
+            if not best_load:
+                break
+            i = (start + offset) % count
+            load = in_flight.get(self.aliases[i], 0) * self.scales[i]
+            if load < best_load:
+                best = i
+                best_load = load
+        return self.aliases[best]
+
+
+class PowerOfTwoSelector(WeightedSelector):
+    """
+    Draws two different aliases by weight and selects the one with the lower
+    average latency according to a LatencyTracker ("power of two choices").
+    Aliases that haven't been used yet count as fastest, so they are tried.
+    """
+
+    def __init__(self, weights, tracker):
+        super(PowerOfTwoSelector, self).__init__(weights)
+        self.tracker = tracker
+
+    def choice(self):
+        first = super(PowerOfTwoSelector, self).choice()
+        if self.count == 1:
+            return first
+        second = super(PowerOfTwoSelector, self).choice()
+        if second == first:
+            # Pick evenly from the other aliases rather than drawing again.
+            i = self.aliases.index(first)
+            j = int(self._random() * (self.count - 1))
+            second = self.aliases[j + 1 if j >= i else j]
+        ewma = self.tracker.ewma
+        if ewma.get(second, 0.0) < ewma.get(first, 0.0):
+            return second
+        return first
+
+
+_MASK = 0xffffffffffffffff
+
+
+def _mix(x):
+    # The splitmix64 finalizer, which spreads every input bit over the output.
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & _MASK
+    return x ^ (x >> 31)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(
+        str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class RendezvousSelector(WeightedSelector):
+    """
+    Weighted rendezvous ("highest random weight") hashing.  ``choice_for``
+    hashes a key into one of ``buckets`` buckets, and each bucket goes to the
+    alias that scores best against it, so a key keeps going to the same
+    alias, and removing an alias only moves the keys that went to it.  Each
+    bucket is scored on first use, by mixing it with a precomputed seed for
+    every alias, so a decision usually costs one hash and a list lookup.
+    ``choice`` selects by weight for queries without a key.
+    """
+    buckets = 4096
+
+    def __init__(self, weights):
+        super(RendezvousSelector, self).__init__(weights)
+        weights = [(alias, weight) for alias, weight in weights if weight > 0]
+        self.seeds = tuple((alias, _hash(alias), weight)
+                           for alias, weight in weights)
+        self.uniform = len(set(weight for alias, weight in weights)) == 1
+        self.table = [None] * self.buckets
+
+    def choice_for(self, key):
+        bucket = _hash(key) % self.buckets
+        alias = self.table[bucket]
+        if alias is None:
+            # Concurrent threads may both score a bucket, with the same result.
+            alias = self.table[bucket] = self.score(bucket)
+        return alias
+
+    def score(self, bucket):
+        """Return the alias with the highest score for ``bucket``."""
+        bucket = _mix(bucket)
+        best = None
+        best_score = -1
+        if self.uniform:
+            # With equal weights, the highest hash has the highest score.
+            for alias, seed, weight in self.seeds:
+                score = _mix(bucket ^ seed)
+                if score > best_score:
+                    best = alias
+                    best_score = score
+            return best
+        for alias, seed, weight in self.seeds:
+            # Map the hash into (0, 1), so the logarithm is finite and
+            # negative, then scale it by the weight.
+            u = (_mix(bucket ^ seed) + 0.5) / 18446744073709551616.0
+            score = weight / -math.log(u)
+            if score > best_score:
+                best = alias
+                best_score = score
+        return best
@@ -0,0 +1,424 @@
+"""
+Routing state shared by the worker processes on a host.
+
+When the DATABASE_POOL_SHARED_STATE setting names a file, the health
+registry, the load tracker and the latency tracker keep their state in that
+file, mapped into memory by every process that uses it.  A database that one
+worker finds failing or slow is then avoided by the others straight away,
+instead of once each worker has found out for itself.
+
+The file is a fixed layout of 8 byte words: a header, a table of aliases, a
+column per alias for when its circuit closes and for its average latency,
+and a row per worker process for the queries and transactions it has open
+on each alias.  Each worker only writes to its own row, so nobody takes a
+lock to count.  Readers add up the rows of the other workers at most once per
+``totals_interval`` and add their own counts as they stand, and a background
+thread in each process clears the rows of workers that exited without
+releasing them.  The file lock is only taken to add an alias or a worker, to
+clear a worker's row, and to open or close circuits.  Aliases beyond the
+first MAX_ALIASES, or with names over NAME_BYTES bytes, are tracked by each
+process on its own, with a warning.
+"""
+import atexit
+import logging
+import mmap
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Identifies the layout below; change it when the layout changes.
+MAGIC = 0x3230454352414c42
+MAX_ALIASES = 64
+MAX_WORKERS = 128
+NAME_BYTES = 64
+
+# The offsets of each part of the file, in words
+_MAGIC = 0
+_GENERATION = 1
+_NAMES = 2
+_OPEN_UNTIL = _NAMES + MAX_ALIASES * NAME_BYTES // 8
+_LATENCY = _OPEN_UNTIL + MAX_ALIASES
+_WORKERS = _LATENCY + MAX_ALIASES
+_ROW = 1 + 2 * MAX_ALIASES
+# The offsets within a worker row
+_IN_FLIGHT = 1
+_TRANSACTIONS = 1 + MAX_ALIASES
+SIZE = (_WORKERS + MAX_WORKERS * _ROW) * 8
+_ROWS = tuple(_WORKERS + worker * _ROW for worker in range(MAX_WORKERS))
+
+logger = logging.getLogger('balancer.shared')
+
+_states = weakref.WeakSet()
+_state = None
+_state_lock = threading.Lock()
+# The process that runs the thread checking for exited workers
+_checker_pid = None
+_checker_lock = threading.Lock()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedState(object):
+    """A state file mapped into the memory of this process."""
+
+    # How often the rows of exited workers are cleared, in seconds
+    workers_interval = 1
+    # How long the totals of the other workers are reused, in seconds
+    totals_interval = 0.01
+
+    def __init__(self, path):
+        try:
+            import fcntl
+        except ImportError:
+            raise ImproperlyConfigured(
+                "DATABASE_POOL_SHARED_STATE needs a platform with fcntl.")
+        self._flock = fcntl.flock
+        self._lock_ex = fcntl.LOCK_EX
+        self._lock_un = fcntl.LOCK_UN
+        self._lock = threading.Lock()
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.locked():
+            size = os.fstat(self.fd).st_size
+            if size == 0:
+                os.ftruncate(self.fd, SIZE)
+            elif size != SIZE:
+                raise ImproperlyConfigured(
+                    "%r is not a shared state file for this version." % path)
+            self.mmap = mmap.mmap(self.fd, SIZE)
+            self.words = memoryview(self.mmap).cast('q')
+            self.floats = memoryview(self.mmap).cast('d')
+            if self.words[_MAGIC] == 0:
+                self.words[_MAGIC] = MAGIC
+            elif self.words[_MAGIC] != MAGIC:
+                raise ImproperlyConfigured(
+                    "%r is not a shared state file for this version." % path)
+        self.indexes = {}
+        self.row = None
+        self._names = []
+        self._totals = None
+        self._totals_checked = 0
+        _states.add(self)
+        _start_checker()
+
+    def reopen(self):
+        """
+        Open the file again in a forked child.  The descriptor inherited from
+        the parent shares its file lock, so the two would never exclude each
+        other.
+        """
+        fd = os.open(self.path, os.O_RDWR)
+        os.close(self.fd)
+        self.fd = fd
+        self._lock = threading.Lock()
+        self.row = None
+        self._totals_checked = 0
+
+    @contextmanager
+    def locked(self):
+        """Hold the file lock, which every process shares."""
+        with self._lock:
+            self._flock(self.fd, self._lock_ex)
+            try:
+                yield
+            finally:
+                self._flock(self.fd, self._lock_un)
+
+    def get_name(self, index):
+        start = (_NAMES * 8) + index * NAME_BYTES
+        return bytes(self.mmap[start:start + NAME_BYTES]).rstrip(b'\0')
+
+    def index(self, alias):
+        """
+        Return the column of ``alias``, adding it to the table if needed, or
+        None if the table is full.
+        """
+        try:
+            return self.indexes[alias]
+        except KeyError:
+            pass
+        name = alias.encode('utf-8')
+        if len(name) > NAME_BYTES:
+            logger.warning("%r is too long to share its state; the limit is "
+                           "%d bytes.", alias, NAME_BYTES)
+            self.indexes[alias] = None
+            return None
+        with self.locked():
+            # Aliases are added in order, so the first empty name ends the
+            # table.
+            for index in range(MAX_ALIASES):
+                stored = self.get_name(index)
+                if not stored:
+                    start = (_NAMES * 8) + index * NAME_BYTES
+                    self.mmap[start:start + len(name)] = name
+                if not stored or stored == name:
+                    self.indexes[alias] = index
+                    return index
+            self.indexes[alias] = None
+        logger.warning("%r can't share its state, since %r already holds "
+                       "%d aliases.", alias, self.path, MAX_ALIASES)
+        return None
+
+    # Health
+
+    @property
+    def generation(self):
+        """A number that changes whenever a circuit is opened."""
+        return self.words[_GENERATION]
+
+    def open_circuit(self, alias, until):
+        """Take ``alias`` out of the pool until ``until``, a time.time()."""
+        index = self.index(alias)
+        if index is None:
+            return
+        with self.locked():
+            self.floats[_OPEN_UNTIL + index] = until
+            self.words[_GENERATION] += 1
+
+    def get_open_circuits(self, now):
+        """
+        Return a dict mapping the aliases whose circuits are open at ``now``
+        to the time.time() when they close.
+        """
+        open_circuits = {}
+        floats = self.floats
+        for index in range(MAX_ALIASES):
+            until = floats[_OPEN_UNTIL + index]
+            if until > now:
+                name = self.get_name(index).decode('utf-8')
+                open_circuits[name] = until
+        return open_circuits
+
+    def close_circuits(self):
+        with self.locked():
+            for index in range(MAX_ALIASES):
+                self.floats[_OPEN_UNTIL + index] = 0.0
+            self.words[_GENERATION] += 1
+
+    # Latency
+
+    def get_latency(self, alias, default=None):
+        index = self.index(alias)
+        if index is None:
+            return default
+        latency = self.floats[_LATENCY + index]
+        return default if latency == 0.0 else latency
+
+    def set_latency(self, alias, latency):
+        index = self.index(alias)
+        if index is not None:
+            self.floats[_LATENCY + index] = latency
+
+    def clear_latency(self):
+        for index in range(MAX_ALIASES):
+            self.floats[_LATENCY + index] = 0.0
+
+    # Queries in flight
+
+    def claim_row(self):
+        """
+        Claim a worker row for this process, taking over the row of a
+        process that has exited, or return None if every row is taken.
+        """
+        pid = os.getpid()
+        _start_checker()
+        with self.locked():
+            for row in _ROWS:
+                owner = self.words[row]
+                if owner and _is_alive(owner):
+                    continue
+                for index in range(1, _ROW):
+                    self.words[row + index] = 0
+                self.words[row] = pid
+                self.row = row
+                self._totals_checked = 0
+                atexit.register(self.release_row, row, pid)
+                return row
+            # Don't look again for every query.
+            self.row = False
+        return None
+
+    def release_row(self, row, pid):
+        if self.words[row] == pid == os.getpid():
+            self.words[row] = 0
+
+    def set_in_flight(self, alias, count):
+        """Publish the number of queries this process has in flight."""
+        self._publish(alias, _IN_FLIGHT, count)
+
+    def set_transactions(self, alias, count):
+        """Publish the number of transactions this process has open."""
+        self._publish(alias, _TRANSACTIONS, count)
+
+    def _publish(self, alias, column, count):
+        row = self.row
+        if row is None:
+            row = self.claim_row()
+        if not row:
+            return
+        index = self.index(alias)
+        if index is not None:
+            self.words[row + column + index] = count
+
+    def check_workers(self):
+        """Clear the rows of workers that exited without releasing them."""
+        words = self.words
+        dead = [row for row in _ROWS
+                if words[row] and not _is_alive(words[row])]
+        if not dead:
+            return
+        with self.locked():
+            for row in dead:
+                owner = words[row]
+                if owner and not _is_alive(owner):
+                    for index in range(1, _ROW):
+                        words[row + index] = 0
+                    words[row] = 0
+        self._totals_checked = 0
+
+    def get_names(self):
+        """Return the aliases in the table, in the order of their columns."""
+        names = self._names
+        # Aliases are only ever added, at the end of the table.
+        while len(names) < MAX_ALIASES:
+            name = self.get_name(len(names))
+            if not name:
+                break
+            names.append(name.decode('utf-8'))
+        return names
+
+    def get_others(self, column):
+        """
+        Return a dict mapping aliases to the sum of ``column`` over the rows
+        of the other workers, added up at most once per ``totals_interval``.
+        """
+        now = time.monotonic()
+        if now - self._totals_checked >= self.totals_interval:
+            words = self.words
+            own = self.row
+            rows = [words[row:row + _ROW].tolist() for row in _ROWS
+                    if words[row] and row != own]
+            sums = [sum(column) for column in zip(*rows)] or [0] * _ROW
+            names = self.get_names()
+            self._totals = dict(
+                (offset, dict((name, sums[offset + index])
+                              for index, name in enumerate(names)))
+                for offset in (_IN_FLIGHT, _TRANSACTIONS))
+            self._totals_checked = now
+        return self._totals[column]
+
+    def get_other_in_flight(self):
+        """Return the queries the other workers have in flight, by alias."""
+        return self.get_others(_IN_FLIGHT)
+
+    def get_other_transactions(self):
+        """Return the transactions the other workers have open, by alias."""
+        return self.get_others(_TRANSACTIONS)
+
+
+class SharedInFlight(object):
+    """
+    The in-flight counts of every worker, read like a dict: the totals of the
+    other workers added to the ``local`` counts of this process.  Aliases
+    that don't fit in the file only have the local counts.
+    """
+
+    def __init__(self, state, local):
+        self.state = state
+        self.local = local
+
+    def get(self, alias, default=0):
+        return (self.state.get_others(_IN_FLIGHT).get(alias, 0) +
+                self.local.get(alias, default))
+
+
+class SharedLatency(object):
+    """
+    The average latencies of a SharedState, used like a dict.  Aliases that
+    don't fit in the file are kept in this process.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.local = {}
+
+    def get(self, alias, default=None):
+        if self.state.index(alias) is None:
+            return self.local.get(alias, default)
+        return self.state.get_latency(alias, default)
+
+    def __setitem__(self, alias, latency):
+        if self.state.index(alias) is None:
+            self.local[alias] = latency
+        else:
+            self.state.set_latency(alias, latency)
+
+
+def _check_workers():
+    while True:
+        time.sleep(SharedState.workers_interval)
+        for state in list(_states):
+            try:
+                state.check_workers()
+            except (OSError, ValueError):
+                # The file is gone or closed.
+                pass
+
+
+def _start_checker():
+    """Start the thread that clears exited workers, once per process."""
+    global _checker_pid
+    pid = os.getpid()
+    with _checker_lock:
+        if _checker_pid == pid:
+            return
+        _checker_pid = pid
+    thread = threading.Thread(target=_check_workers,
+                              name='balancer-shared-checker')
+    thread.daemon = True
+    thread.start()
+
+
+def _after_fork_in_child():
+    # The child needs its own file lock, and its own row for its queries in
+    # flight; claiming the row starts its thread to check for exited workers.
+    global _checker_lock
+    _checker_lock = threading.Lock()
+    for state in list(_states):
+        try:
+            state.reopen()
+        except OSError:
+            # The file is gone, so nobody else can lock it either.
+            state.row = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_state():
+    """
+    Return the SharedState for the DATABASE_POOL_SHARED_STATE setting, shared
+    by every router in this process, or None if the setting isn't used.
+    """
+    global _state
+    from django.conf import settings
+    path = getattr(settings, 'DATABASE_POOL_SHARED_STATE', None)
+    if path is None:
+        return None
+    with _state_lock:
+        if _state is None or _state.path != path:
+            _state = SharedState(path)
+        return _state
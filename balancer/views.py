@@ -0,0 +1,10 @@
+from django.http import HttpResponse
+
+from balancer.metrics import registry
+
+
+def metrics(request):
+    """Export the routing metrics for Prometheus."""
+    return HttpResponse(registry.export_text(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
@@ -0,0 +1,80 @@
+"""
+Opening connections to the pool before the first request.
+
+Call ``warm_up`` once per worker process, after it has forked, and never
+from a process that forks workers, or they would share its connections.
+Under gunicorn, point the ``post_worker_init`` server hook at
+``balancer.warmup.post_worker_init``, which also covers ``preload_app``.
+Warming up isn't done when the app loads, since that would also open
+connections for every management command.
+"""
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+from balancer.health import registry
+
+logger = logging.getLogger('balancer.warmup')
+
+WarmUpResult = namedtuple('WarmUpResult', 'alias seconds error')
+
+
+def get_aliases():
+    """Return the aliases in DATABASE_POOL, followed by MASTER_DATABASE."""
+    from django.conf import settings
+    aliases = list(getattr(settings, 'DATABASE_POOL', ()))
+    master = getattr(settings, 'MASTER_DATABASE', None)
+    if master is not None and master not in aliases:
+        aliases.append(master)
+    return aliases
+
+
+def _connect(connection):
+    start = time.perf_counter()
+    # The connection belongs to the calling thread, which will use it once
+    # this returns.
+    connection.inc_thread_sharing()
+    try:
+        connection.ensure_connection()
+        if not connection.is_usable():
+            raise RuntimeError("The connection is not usable.")
+    except Exception as e:
+        return time.perf_counter() - start, e
+    finally:
+        connection.dec_thread_sharing()
+    return time.perf_counter() - start, None
+
+
+def warm_up(aliases=None, max_workers=None):
+    """
+    Open and validate the calling thread's connections to ``aliases``, or to
+    every database in the pool and the master, in parallel.  Databases that
+    fail to connect start out with an open circuit in the health registry.
+    Returns a list of WarmUpResult tuples with the time taken by each alias.
+    """
+    if aliases is None:
+        aliases = get_aliases()
+    wrappers = [connections[alias] for alias in aliases]
+    if not wrappers:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(wrappers)) as pool:
+        outcomes = list(pool.map(_connect, wrappers))
+
+    results = []
+    for alias, (seconds, error) in zip(aliases, outcomes):
+        results.append(WarmUpResult(alias, seconds, error))
+        if error is None:
+            logger.info("Connected to %r in %.1fms.", alias, seconds * 1000)
+        else:
+            registry.trip(alias)
+            logger.warning("Could not connect to %r: %s", alias, error)
+    return results
+
+
+def post_worker_init(worker):
+    """A gunicorn server hook that warms up the worker's connections."""
+    warm_up()
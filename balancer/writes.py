@@ -0,0 +1,106 @@
+"""
+Pinning on committed writes.
+
+By default the pinning mixins pin as soon as Django asks a router where to
+write, which also happens for ``get_or_create`` calls that only read, for
+``select_for_update`` and for transactions that are rolled back.  When the
+MASTER_PINNING_MODE setting is ``'commit'``, they leave that to the
+WriteObserver instead.  It sees every INSERT, UPDATE and DELETE that
+succeeds on the master of one of those routers, and records the write once
+it is committed: straight away in autocommit mode, or from
+``transaction.on_commit`` inside a transaction, so a rollback never pins.
+Writes to other databases don't pin.
+"""
+import re
+import weakref
+from functools import partial
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+
+from balancer import instrumentation, pinning
+
+MODES = ('route', 'commit')
+
+# Finds the table, possibly quoted and qualified by a schema, in an INSERT,
+# UPDATE, DELETE or REPLACE statement
+TABLE_RE = re.compile(
+    r'\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)'
+    r'\s+([^\s(]+)', re.IGNORECASE)
+
+_labels = None
+
+
+def get_table(sql):
+    """
+    Return the table written by ``sql``, without its schema or quotes, or
+    None.
+    """
+    match = TABLE_RE.match(sql)
+    if match is None:
+        return None
+    return match.group(1).rsplit('.', 1)[-1].strip('`"[]')
+
+
+def get_label(table):
+    """Return the label of the model stored in ``table``, or None."""
+    global _labels
+    labels = _labels
+    if labels is None:
+        from django.apps import apps
+        labels = _labels = dict(
+            (model._meta.db_table, model._meta.label_lower)
+            for model in apps.get_models(include_auto_created=True))
+    return labels.get(table)
+
+
+def record_write(label):
+    """
+    Pin the current request to the master, and the model ``label`` if it is
+    known, as the pinning mixins do in the default mode.
+    """
+    pinning.set_db_write()
+    pinning.pin_thread()
+    if label is not None:
+        pinning.set_model_write(label)
+        if not pinning.model_is_pinned(label):
+            pinning.pin_models((label,))
+
+
+class WriteObserver(instrumentation.QueryObserver):
+    """Records the committed writes on the masters of the routers."""
+    observes_writes = True
+
+    def __init__(self):
+        self.routers = weakref.WeakSet()
+
+    def write_succeeded(self, alias, sql):
+        if not any(router.master == alias for router in list(self.routers)):
+            return
+        table = get_table(sql)
+        label = get_label(table) if table is not None else None
+        if connections[alias].in_atomic_block:
+            transaction.on_commit(partial(record_write, label), using=alias)
+        else:
+            record_write(label)
+
+
+observer = WriteObserver()
+
+
+def pins_on_commit(router):
+    """
+    Check whether the MASTER_PINNING_MODE setting is ``'commit'``, and if so
+    start observing the writes to ``router``'s master.
+    """
+    from django.conf import settings
+    mode = getattr(settings, 'MASTER_PINNING_MODE', 'route')
+    if mode not in MODES:
+        raise ImproperlyConfigured(
+            "MASTER_PINNING_MODE must be one of %s, not %r." % (
+                ', '.join(repr(m) for m in MODES), mode))
+    if mode == 'commit':
+        observer.routers.add(router)
+        instrumentation.add_observer(observer)
+        return True
+    return False
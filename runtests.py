@@ -7,7 +7,6 @@ try:
     settings.configure(
         DEBUG=True,
         USE_TZ=True,
-        ROOT_URLCONF="balancer.urls",
         INSTALLED_APPS=[
             "django.contrib.auth",
             "django.contrib.contenttypes",
@@ -15,22 +14,16 @@ try:
             "balancer",
         ],
         SITE_ID=1,
-        NOSE_ARGS=['-s', '--verbosity=2',],
-        MIDDLEWARE_CLASSES=(),
+        MIDDLEWARE=(),
         DATABASES=balancer.TEST_DATABASES,
         MASTER_DATABASE=balancer.TEST_MASTER_DATABASE,
         DATABASE_POOL=balancer.TEST_DATABASE_POOL,
     )
 
-    try:
-        import django
-        setup = django.setup
-    except AttributeError:
-        pass
-    else:
-        setup()
+    import django
+    django.setup()
 
-    from django_nose import NoseTestSuiteRunner
+    from django.test.runner import DiscoverRunner
 except ImportError:
     import traceback
     traceback.print_exc()
@@ -42,7 +35,7 @@ def run_tests(*test_args):
         test_args = ['tests',]
 
     # Run tests
-    test_runner = NoseTestSuiteRunner(interactive=False)
+    test_runner = DiscoverRunner(interactive=False, verbosity=2)
 
     failures = test_runner.run_tests(test_args)
 
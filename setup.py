@@ -31,10 +31,19 @@ setup(
     author_email='mike@drund.com',
     license='License :: OSI Approved :: BSD License',
     url='http://github.com/michaelhelmick/django-balancer',
-    packages=['balancer'],
+    packages=['balancer', 'balancer.management',
+              'balancer.management.commands'],
+    python_requires='>=3.8',
+    install_requires=['Django>=4.2'],
     classifiers=[
         'Framework :: Django',
+        'Framework :: Django :: 4.2',
+        'Framework :: Django :: 5.0',
+        'Framework :: Django :: 5.1',
+        'Framework :: Django :: 5.2',
         'Intended Audience :: Developers',
         'Development Status :: 3 - Alpha',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
     ]
 )
@@ -0,0 +1,85 @@
+from django.conf import settings
+
+from balancer import drain
+from balancer.context import affinity, sticky_scope
+from balancer.routers import AffinityRouter, AffinityMasterSlaveRouter
+from balancer.selection import RendezvousSelector
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class Model(object):
+
+    class _meta(object):
+        label_lower = 'tests.model'
+
+
+class Instance(object):
+
+    class _state(object):
+        db = None
+
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class AffinityRouterTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(AffinityRouterTestCase, self).setUp()
+        settings.DATABASE_POOL = {
+            'default': 1,
+            'other': 1,
+            'utility': 1,
+        }
+        self.router = AffinityRouter()
+
+    def tearDown(self):
+        super(AffinityRouterTestCase, self).tearDown()
+        drain.set_draining(())
+
+    def route(self, pk):
+        return self.router.db_for_read(Model, instance=Instance(pk))
+
+    def test_same_key_same_db(self):
+        for pk in range(20):
+            self.assertEqual(len(set(self.route(pk) for i in range(10))), 1)
+        self.assertEqual(len(set(self.route(pk) for pk in range(100))), 3)
+
+    def test_keys(self):
+        """The context key wins over the instance, which wins over the model."""
+        selector = self.router.selector
+        self.assertEqual(self.router.db_for_read(Model),
+                         selector.choice_for('tests.model'))
+        self.assertEqual(self.route(7), selector.choice_for('tests.model:7'))
+        with affinity('tenant-1'):
+            self.assertEqual(self.route(7), selector.choice_for('tenant-1'))
+
+    def test_scope_is_ignored(self):
+        with sticky_scope():
+            self.assertEqual(len(set(self.route(pk) for pk in range(100))), 3)
+
+    def test_only_removed_keys_move(self):
+        before = dict((pk, self.route(pk)) for pk in range(300))
+        drain.drain('other')
+        after = dict((pk, self.route(pk)) for pk in range(300))
+        for pk in before:
+            if before[pk] == 'other':
+                self.assertNotEqual(after[pk], 'other')
+            else:
+                self.assertEqual(after[pk], before[pk])
+
+    def test_weights(self):
+        selector = RendezvousSelector((('a', 1), ('b', 3)))
+        counts = {'a': 0, 'b': 0}
+        for key in range(4000):
+            counts[selector.choice_for(key)] += 1
+        self.assertAlmostEqual(counts['b'] / 4000.0, 0.75, delta=0.05)
+
+
+class AffinityMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+    """Tests for the AffinityMasterSlaveRouter."""
+
+    def setUp(self):
+        super(AffinityMSRouterTestCase, self).setUp()
+        self.router = AffinityMasterSlaveRouter()
@@ -0,0 +1,31 @@
+from balancer import bench
+
+from . import BalancerTestCase
+
+
+class BenchTestCase(BalancerTestCase):
+
+    def test_run(self):
+        results = bench.run(['RandomRouter', 'PinningWMSRouter'],
+                            pool_sizes=(2,), thread_counts=(1, 2),
+                            decisions=100)
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertTrue(result['decisions_per_second'] > 0)
+            if result['threads'] == 1:
+                self.assertIn('peak_bytes', result)
+
+    def test_router_classes(self):
+        classes = bench.get_router_classes()
+        self.assertIn('WeightedMasterSlaveRouter', classes)
+        self.assertNotIn('BasePoolRouter', classes)
+
+    def test_compare(self):
+        baseline = [{'router': 'RandomRouter', 'pool_size': 2, 'threads': 1,
+                     'decisions_per_second': 1000.0, 'retained_bytes': 0.0}]
+        results = [dict(baseline[0], decisions_per_second=900.0)]
+        self.assertEqual(bench.compare(results, baseline, 0.2), [])
+
+        results = [dict(baseline[0], decisions_per_second=700.0,
+                        retained_bytes=64.0)]
+        self.assertEqual(len(bench.compare(results, baseline, 0.2)), 2)
@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from balancer import pinning
+from balancer.causal import (
+    DatabasePositionProvider, FakePositionProvider, MySQLPositionProvider,
+)
+from balancer.middleware import (
+    POSITION_KEY,
+    CausalSessionMiddleware,
+    CausalCookieMiddleware,
+)
+from balancer.routers import CausalWMSRouter
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class MockRequest(object):
+    method = 'POST'
+
+    def __init__(self):
+        self.COOKIES = {}
+        self.session = {}
+
+
+class MockResponse(object):
+
+    def __init__(self):
+        self.cookies = {}
+
+    def set_cookie(self, key, value, max_age):
+        self.cookies[key] = value
+
+
+class CausalWMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+
+    def setUp(self):
+        super(CausalWMSRouterTestCase, self).setUp()
+        settings.DATABASE_POOL_POSITION_PROVIDER = (
+            'balancer.causal.FakePositionProvider')
+        FakePositionProvider.reset()
+        self.router = CausalWMSRouter()
+
+    def tearDown(self):
+        super(CausalWMSRouterTestCase, self).tearDown()
+        del settings.DATABASE_POOL_POSITION_PROVIDER
+        pinning.clear_position()
+        pinning.unpin_thread()
+        pinning.clear_db_write()
+
+    def reads(self):
+        return set(self.router.db_for_read(self.obj1) for i in range(100))
+
+    def test_middleware(self):
+        for middleware in (CausalSessionMiddleware(),
+                           CausalCookieMiddleware()):
+            FakePositionProvider.reset()
+            request = MockRequest()
+            middleware.process_request(request)
+            self.assertEqual(self.reads(), set(['default', 'other']))
+
+            # Reads after a write in the same request go to the master.
+            self.router.db_for_write(self.obj1)
+            self.assertEqual(self.reads(), set(['default']))
+            response = middleware.process_response(request, MockResponse())
+            self.assertEqual(pinning.required_position(), None)
+            self.assertFalse(pinning.thread_is_pinned())
+
+            # The next request can't read from 'other' until it catches up.
+            request.COOKIES = response.cookies
+            middleware.process_request(request)
+            if request.COOKIES:
+                self.assertEqual(request.COOKIES[POSITION_KEY], '1')
+            else:
+                self.assertEqual(request.session[POSITION_KEY][0], '1')
+            self.assertEqual(self.reads(), set(['default']))
+
+            FakePositionProvider.set_position('other', 1)
+            self.assertEqual(self.reads(), set(['default', 'other']))
+            middleware.process_response(request, MockResponse())
+
+    def test_parse_once(self):
+        middleware = CausalCookieMiddleware()
+        parse_position = FakePositionProvider.parse_position
+        parsed = []
+
+        def parse(provider, position):
+            parsed.append(position)
+            return parse_position(provider, position)
+        FakePositionProvider.parse_position = parse
+        try:
+            request = MockRequest()
+            request.COOKIES[POSITION_KEY] = '1'
+            middleware.process_request(request)
+            self.assertEqual(self.reads(), set(['default']))
+            FakePositionProvider.set_position('other', 1)
+            self.assertEqual(self.reads(), set(['default', 'other']))
+            self.assertEqual(parsed, ['1'])
+        finally:
+            FakePositionProvider.parse_position = parse_position
+            middleware.process_response(request, MockResponse())
+
+    def test_invalid_position(self):
+        middleware = CausalCookieMiddleware()
+        FakePositionProvider.set_position('other', 1)
+        request = MockRequest()
+        request.COOKIES[POSITION_KEY] = 'garbage'
+        middleware.process_request(request)
+        self.assertEqual(self.reads(), set(['default']))
+        middleware.process_response(request, MockResponse())
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+
+class MySQLProvider(MySQLPositionProvider):
+
+    def __init__(self, executed):
+        super(MySQLProvider, self).__init__()
+        self.executed = executed
+        self.queries = 0
+
+    def query(self, alias, sql):
+        self.queries += 1
+        return self.executed
+
+
+class PositionProviderTestCase(BalancerTestCase):
+
+    def test_gtid_subset(self):
+        uuid = '3e11fa47-71ca-11e1-9e33-c80aa9429562'
+        provider = MySQLProvider('%s:1-5:7-9,\n%s:tag:1-3' % (uuid, uuid))
+
+        def has_replayed(position):
+            return provider.has_replayed('other',
+                                         provider.parse_position(position))
+        self.assertTrue(has_replayed('%s:2-4' % uuid))
+        self.assertTrue(has_replayed('%s:9' % uuid.upper()))
+        self.assertTrue(has_replayed('%s:tag:3' % uuid))
+        self.assertFalse(has_replayed('%s:5-7' % uuid))
+        self.assertFalse(has_replayed('%s:tag:4' % uuid))
+        self.assertFalse(has_replayed(
+            '3e11fa47-71ca-11e1-9e33-c80aa9429563:1'))
+        self.assertRaises(ValueError, provider.parse_position, uuid)
+        self.assertRaises(ValueError, provider.parse_position, '%s:x' % uuid)
+
+    def test_gtid_cache(self):
+        provider = MySQLProvider('3e11fa47-71ca-11e1-9e33-c80aa9429562:1-5')
+        position = provider.parse_position(
+            '3e11fa47-71ca-11e1-9e33-c80aa9429562:3')
+        for i in range(10):
+            provider.has_replayed('other', position)
+        self.assertEqual(provider.queries, 1)
+
+    def test_unsupported_vendor(self):
+        """The test databases use SQLite, which has no position provider."""
+        self.assertRaises(ImproperlyConfigured, DatabasePositionProvider)
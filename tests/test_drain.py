@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+
+from balancer import context, drain, instrumentation
+from balancer.context import sticky_scope
+from balancer.load import LoadTracker, tracker
+from balancer.routers import WeightedMasterSlaveRouter
+from balancer.shared import SharedState
+
+from . import BalancerTestCase
+
+
+class DrainTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(DrainTestCase, self).setUp()
+        self.router = WeightedMasterSlaveRouter()
+
+    def tearDown(self):
+        super(DrainTestCase, self).tearDown()
+        drain.set_draining(())
+
+    def reads(self):
+        return set(self.router.db_for_read(self.obj1) for i in range(100))
+
+    def test_drain(self):
+        drain.drain('other')
+        self.assertEqual(self.reads(), set(['default']))
+        self.assertTrue(drain.is_idle('other'))
+        drain.undrain('other')
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+    def test_open_scopes_finish(self):
+        token = context.begin_scope()
+        while self.router.db_for_read(self.obj1) != 'other':
+            context.end_scope(token)
+            token = context.begin_scope()
+        try:
+            drain.drain('other')
+            self.assertFalse(drain.is_idle('other'))
+            self.assertFalse(drain.wait_until_idle('other', timeout=0.01,
+                                                   interval=0.005))
+
+            # The request keeps the database it started with, while new
+            # requests don't get it.
+            self.assertEqual(self.reads(), set(['other']))
+            with sticky_scope():
+                self.assertEqual(self.reads(), set(['default']))
+        finally:
+            context.end_scope(token)
+        self.assertTrue(drain.wait_until_idle('other', timeout=0))
+
+    def test_open_transactions(self):
+        connection = connections['other']
+        connection.in_atomic_block = True
+        try:
+            tracker.query_started('other')
+            tracker.query_finished('other', 0.1, None)
+            # The transaction is still open after its last query.
+            self.assertFalse(drain.is_idle('other'))
+        finally:
+            connection.in_atomic_block = False
+        self.assertTrue(drain.is_idle('other'))
+
+    def test_tracker_installed(self):
+        self.assertIn(tracker, instrumentation._observers)
+
+    def test_other_processes(self):
+        directory = tempfile.mkdtemp()
+        settings.DATABASE_POOL_SHARED_STATE = os.path.join(directory, 'state')
+        try:
+            drain.install_tracker()
+            tracker.shared.totals_interval = 0
+            # A second mapping of the file stands in for another worker.
+            worker = LoadTracker()
+            worker.share(SharedState(settings.DATABASE_POOL_SHARED_STATE))
+            worker.query_started('other')
+            self.assertFalse(drain.is_idle('other'))
+            worker.query_finished('other', 0.1, None)
+            self.assertTrue(drain.is_idle('other'))
+
+            connection = connections['other']
+            connection.in_atomic_block = True
+            try:
+                worker.query_started('other')
+                worker.query_finished('other', 0.1, None)
+                self.assertFalse(drain.is_idle('other'))
+            finally:
+                connection.in_atomic_block = False
+            worker.end_transactions()
+            self.assertTrue(drain.is_idle('other'))
+        finally:
+            del settings.DATABASE_POOL_SHARED_STATE
+            tracker.shared = None
+            tracker.in_flight = tracker.counts
+            shutil.rmtree(directory)
+
+    def test_pool_file(self):
+        directory = tempfile.mkdtemp()
+        settings.DATABASE_POOL_FILE = os.path.join(directory, 'pool.json')
+        settings.DATABASE_POOL_FILE_INTERVAL = 0
+        try:
+            router = WeightedMasterSlaveRouter()
+            call_command('set_database_pool', drain=['other'],
+                         stdout=open(os.devnull, 'w'))
+            self.assertEqual(
+                set(router.db_for_read(self.obj1) for i in range(100)),
+                set(['default']))
+            self.assertEqual(drain.draining, frozenset(['other']))
+            self.assertRaises(CommandError, call_command, 'set_database_pool',
+                              drain=['other'], wait=True)
+        finally:
+            del settings.DATABASE_POOL_FILE
+            del settings.DATABASE_POOL_FILE_INTERVAL
+            shutil.rmtree(directory)
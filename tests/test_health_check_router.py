@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+
+from balancer.health import HealthRegistry, registry
+from balancer.routers import HealthCheckWMSRouter
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class HealthCheckWMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+
+    def setUp(self):
+        super(HealthCheckWMSRouterTestCase, self).setUp()
+        settings.DATABASE_POOL_CONNECT_CHECK = False
+        registry.reset()
+        self.router = HealthCheckWMSRouter()
+
+    def tearDown(self):
+        super(HealthCheckWMSRouterTestCase, self).tearDown()
+        del settings.DATABASE_POOL_CONNECT_CHECK
+        registry.reset()
+
+    def reads(self):
+        return set(self.router.db_for_read(self.obj1) for i in range(100))
+
+    def test_failing_slave_is_excluded(self):
+        self.assertEqual(self.reads(), set(['default', 'other']))
+        registry.trip('other')
+        self.assertEqual(self.reads(), set(['default']))
+        registry.record_success('other')
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+    def test_fallback_to_master(self):
+        settings.DATABASE_POOL = {
+            'other': 1,
+            'utility': 1,
+        }
+        self.router = HealthCheckWMSRouter()
+        registry.trip('other')
+        registry.trip('utility')
+        self.assertEqual(self.reads(), set(['default']))
+
+    def test_connect_check(self):
+        """A slave that refuses connections should be skipped at once."""
+        self.router.connect_check = True
+
+        def check_connection(alias):
+            if alias == 'other':
+                registry.trip(alias)
+                return False
+            return True
+
+        with mock.patch.object(registry, 'check_connection',
+                               side_effect=check_connection):
+            self.assertEqual(self.reads(), set(['default']))
+        self.assertEqual(registry.get_unhealthy(), frozenset(['other']))
+
+    def test_query_errors_are_observed(self):
+        # An SQL error on a working connection isn't a health problem.
+        with self.assertRaises(OperationalError):
+            connection.cursor().execute('SELECT * FROM balancer_missing')
+        self.assertNotIn('default', registry._circuits)
+
+        with mock.patch.object(connections['default'], 'is_usable',
+                               return_value=False):
+            with self.assertRaises(OperationalError):
+                connection.cursor().execute('SELECT * FROM balancer_missing')
+        self.assertEqual(registry._circuits['default'].failures, 1)
+        connection.cursor().execute('SELECT 1')
+        self.assertNotIn('default', registry._circuits)
+
+
+class HealthRegistryTestCase(BalancerTestCase):
+
+    def test_backoff(self):
+        health = HealthRegistry(failure_threshold=2, backoff=1, max_backoff=3)
+        with mock.patch('time.monotonic', return_value=100):
+            health.record_failure('other')
+            self.assertTrue(health.is_healthy('other'))
+            health.record_failure('other')
+            self.assertFalse(health.is_healthy('other'))
+
+        # Half-open after the backoff; one more failure reopens the circuit
+        # for twice as long.
+        with mock.patch('time.monotonic', return_value=101):
+            self.assertTrue(health.is_healthy('other'))
+            health.record_failure('other')
+        with mock.patch('time.monotonic', return_value=102.5):
+            self.assertFalse(health.is_healthy('other'))
+        with mock.patch('time.monotonic', return_value=103):
+            self.assertTrue(health.is_healthy('other'))
+            health.record_failure('other')
+            self.assertEqual(health._circuits['other'].backoff, 3)
+
+        health.record_success('other')
+        self.assertEqual(health._circuits, {})
@@ -0,0 +1,68 @@
+from django.conf import settings
+
+from balancer import drain, pinning
+from balancer.health import registry
+from balancer.routers import (
+    HealthCheckWMSRouter, PinningWMSRouter, RoundRobinRouter,
+)
+
+from . import BalancerTestCase
+
+
+class FollowInstanceTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(FollowInstanceTestCase, self).setUp()
+        settings.DATABASE_POOL = ['default', 'other', 'utility']
+        settings.DATABASE_POOL_CONNECT_CHECK = False
+        self.router = RoundRobinRouter()
+
+    def tearDown(self):
+        super(FollowInstanceTestCase, self).tearDown()
+        del settings.DATABASE_POOL_CONNECT_CHECK
+        drain.set_draining(())
+        registry.reset()
+        pinning.unpin_thread()
+
+    def read(self, router, db):
+        self.obj1._state.db = db
+        return router.db_for_read(self.obj2, instance=self.obj1)
+
+    def test_follow_instance(self):
+        for i in range(6):
+            self.assertEqual(self.read(self.router, 'other'), 'other')
+
+    def test_not_in_pool(self):
+        """Instances from outside the pool are routed as usual."""
+        settings.DATABASE_POOL = ['default', 'utility']
+        router = RoundRobinRouter()
+        reads = set(self.read(router, 'other') for i in range(4))
+        self.assertEqual(reads, set(['default', 'utility']))
+        self.assertEqual(set(self.read(router, None) for i in range(4)),
+                         set(['default', 'utility']))
+
+    def test_pinned(self):
+        """The instance's database is kept even when the thread is pinned."""
+        router = PinningWMSRouter()
+        pinning.pin_thread()
+        self.assertEqual(self.read(router, 'other'), 'other')
+        self.assertEqual(router.db_for_read(self.obj2), 'default')
+
+    def test_excluded(self):
+        router = HealthCheckWMSRouter()
+        registry.trip('other')
+        self.assertNotEqual(self.read(router, 'other'), 'other')
+
+        # Draining databases are still followed, as the request that loaded
+        # the instance may finish on them.
+        drain.drain('utility')
+        self.assertEqual(self.read(router, 'utility'), 'utility')
+
+    def test_switched_off(self):
+        settings.DATABASE_POOL_FOLLOW_INSTANCE = False
+        try:
+            router = RoundRobinRouter()
+        finally:
+            del settings.DATABASE_POOL_FOLLOW_INSTANCE
+        reads = set(self.read(router, 'other') for i in range(3))
+        self.assertEqual(reads, set(['default', 'other', 'utility']))
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from django.conf import settings
+
+from balancer.lag import BaseLagProbe, LagMonitor, MemoryLagProbe
+from balancer.routers import LagAwareWMSRouter
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class LagAwareWMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+
+    def setUp(self):
+        super(LagAwareWMSRouterTestCase, self).setUp()
+        settings.DATABASE_POOL_LAG_PROBE = 'balancer.lag.MemoryLagProbe'
+        settings.DATABASE_POOL_LAG_INTERVAL = 60
+        settings.DATABASE_POOL_MAX_LAG = 5
+        self.router = LagAwareWMSRouter()
+
+    def tearDown(self):
+        super(LagAwareWMSRouterTestCase, self).tearDown()
+        del settings.DATABASE_POOL_LAG_PROBE
+        del settings.DATABASE_POOL_LAG_INTERVAL
+        del settings.DATABASE_POOL_MAX_LAG
+        MemoryLagProbe.reset()
+
+    def reads(self):
+        # Probe now rather than wait for the monitor's thread.
+        self.router.lag_monitor.check()
+        return set(self.router.db_for_read(self.obj1) for i in range(100))
+
+    def test_lagging_slave_is_excluded(self):
+        """The master isn't probed, and a lagging slave isn't read from."""
+        self.assertEqual(self.router.lag_monitor.aliases, ('other',))
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+        MemoryLagProbe.set_lag('other', 60)
+        self.assertEqual(self.reads(), set(['default']))
+
+        MemoryLagProbe.set_lag('other', 1)
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+    def test_fallback_to_master(self):
+        """When every slave is lagging, reads should go to the master."""
+        settings.DATABASE_POOL = {
+            'other': 1,
+            'utility': 1,
+        }
+        self.router = LagAwareWMSRouter()
+        MemoryLagProbe.set_lag('other', 60)
+        MemoryLagProbe.set_lag('utility', 60)
+        self.assertEqual(self.reads(), set(['default']))
+
+    def test_monitor_interval(self):
+        """The probe should only run once per interval."""
+        monitor = LagMonitor(['other'], MemoryLagProbe(), max_lag=5,
+                             interval=60)
+        monitor.check()
+        self.assertEqual(monitor.get_lagging(), frozenset())
+        MemoryLagProbe.set_lag('other', 60)
+        self.assertEqual(monitor.get_lagging(), frozenset())
+        monitor.check()
+        self.assertEqual(monitor.get_lagging(), frozenset(['other']))
+
+    def test_background_probe(self):
+        """A slow probe runs in its own thread and doesn't hold up routing."""
+        release = threading.Event()
+        threads = []
+
+        class SlowProbe(BaseLagProbe):
+            def get_lag(self, alias):
+                threads.append(threading.current_thread())
+                release.wait(10)
+                return 60
+
+        monitor = LagMonitor(['other'], SlowProbe(), max_lag=5, interval=60)
+        self.assertEqual(monitor.get_lagging(), frozenset())
+        release.set()
+        deadline = time.monotonic() + 10
+        while not monitor.lagging and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(monitor.get_lagging(), frozenset(['other']))
+        self.assertNotIn(threading.current_thread(), threads)
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import connection
+
+from balancer.latency import LatencyTracker, tracker
+from balancer.routers import LatencyRouter, LatencyMasterSlaveRouter
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class LatencyRouterTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(LatencyRouterTestCase, self).setUp()
+        settings.DATABASE_POOL = ['default', 'other', 'utility']
+        self.router = LatencyRouter()
+        self.router.tracker = LatencyTracker(decay=0.5)
+        self.router.set_pool(settings.DATABASE_POOL)
+
+    def count_reads(self):
+        hits = {'default': 0, 'other': 0, 'utility': 0}
+        for i in range(300):
+            hits[self.router.db_for_read(self.obj1)] += 1
+        return hits
+
+    def test_faster_db_is_preferred(self):
+        self.router.tracker.record('default', 0.010)
+        self.router.tracker.record('other', 0.001)
+        self.router.tracker.record('utility', 0.100)
+        hits = self.count_reads()
+
+        # Two distinct candidates are always compared, so the slowest
+        # database never wins and the fastest wins two times in three.
+        self.assertEqual(hits['utility'], 0)
+        self.assertTrue(hits['other'] > hits['default'] > 0)
+
+    def test_moving_average(self):
+        self.router.tracker.record('default', 0.010)
+        self.router.tracker.record('default', 0.030)
+        self.assertAlmostEqual(self.router.tracker.get_latency('default'),
+                               0.020)
+        self.router.tracker.query_finished('default', 1.0, Exception())
+        self.assertAlmostEqual(self.router.tracker.get_latency('default'),
+                               0.020)
+
+    def test_queries_are_tracked(self):
+        tracker.reset()
+        connection.cursor().execute('SELECT 1')
+        self.assertTrue(tracker.get_latency('default') > 0)
+
+
+class LatencyMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+    """Tests for the LatencyMasterSlaveRouter."""
+
+    def setUp(self):
+        super(LatencyMSRouterTestCase, self).setUp()
+        self.router = LatencyMasterSlaveRouter()
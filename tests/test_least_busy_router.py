@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import connection
+
+from balancer.load import LoadTracker, tracker
+from balancer.routers import LeastBusyRouter, LeastBusyMasterSlaveRouter
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class LeastBusyRouterTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(LeastBusyRouterTestCase, self).setUp()
+        self.router = LeastBusyRouter()
+        self.router.tracker = LoadTracker()
+        self.router.set_pool(settings.DATABASE_POOL)
+
+    def reads(self):
+        return set(self.router.db_for_read(self.obj1) for i in range(100))
+
+    def test_idle_pool(self):
+        """With nothing in flight, every database should be offered."""
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+    def test_least_busy_db_selection(self):
+        self.router.tracker.query_started('default')
+        self.assertEqual(self.reads(), set(['other']))
+
+        # 'other' has twice the weight, so it takes two queries in flight to
+        # make it as busy as one query on 'default'.
+        self.router.tracker.query_started('other')
+        self.assertEqual(self.reads(), set(['other']))
+        self.router.tracker.query_started('other')
+        self.assertEqual(self.reads(), set(['default', 'other']))
+
+        self.router.tracker.query_finished('default', 0.1, None)
+        self.assertEqual(self.reads(), set(['default']))
+
+    def test_queries_are_tracked(self):
+        seen = []
+
+        def wrapper(execute, sql, params, many, context):
+            seen.append(tracker.get_in_flight('default'))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(wrapper):
+            connection.cursor().execute('SELECT 1')
+        self.assertEqual(seen, [1])
+        self.assertEqual(tracker.get_in_flight('default'), 0)
+
+
+class LeastBusyMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+    """Tests for the LeastBusyMasterSlaveRouter."""
+
+    def setUp(self):
+        super(LeastBusyMSRouterTestCase, self).setUp()
+        self.router = LeastBusyMasterSlaveRouter()
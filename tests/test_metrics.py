@@ -0,0 +1,72 @@
+import threading
+
+from django.conf import settings
+from django.test import RequestFactory
+
+from balancer import pinning
+from balancer.metrics import registry
+from balancer.routers import PinningWMSRouter
+from balancer.views import metrics
+
+from . import BalancerTestCase
+
+
+class MetricsTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        settings.DATABASE_POOL_METRICS = True
+        registry.reset()
+        self.router = PinningWMSRouter()
+
+    def tearDown(self):
+        super(MetricsTestCase, self).tearDown()
+        del settings.DATABASE_POOL_METRICS
+        pinning.unpin_thread()
+        pinning.clear_db_write()
+
+    def test_counters(self):
+        def route():
+            for i in range(100):
+                self.router.db_for_read(self.obj1)
+
+        threads = [threading.Thread(target=route) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.router.db_for_write(self.obj1)
+        for i in range(10):
+            self.assertEqual(self.router.db_for_read(self.obj1), 'default')
+
+        # The finished threads' shards were merged into the totals
+        self.assertEqual(len(registry._shards), 1)
+        total = registry.snapshot()
+        self.assertEqual(sum(total.counts['read'].values()), 410)
+        self.assertEqual(total.counts['write'], {'default': 1})
+        self.assertEqual(total.counts['pinned'], {'default': 10})
+        self.assertEqual(sum(total.buckets['read']), 410)
+
+    def test_export(self):
+        self.router.db_for_write(self.obj1)
+        self.router.db_for_read(self.obj1)
+        response = metrics(RequestFactory().get('/metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+        text = response.content.decode('utf-8')
+        self.assertIn('balancer_writes_total{database="default"} 1\n', text)
+        self.assertIn('balancer_pinned_reads_total{database="default"} 1\n',
+                      text)
+        self.assertIn('# TYPE balancer_routing_seconds histogram\n', text)
+        self.assertIn(
+            'balancer_routing_seconds_bucket{operation="read",le="+Inf"} 1\n',
+            text)
+        self.assertIn('balancer_routing_seconds_count{operation="write"} 1\n',
+                      text)
+
+    def test_escaped_labels(self):
+        registry.record('read', 'a"b\\c\nd', 0.0)
+        text = registry.export_text()
+        self.assertIn('balancer_reads_total{database="a\\"b\\\\c\\nd"} 1\n',
+                      text)
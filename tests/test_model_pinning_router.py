@@ -0,0 +1,86 @@
+import time
+
+from django.contrib.auth.models import Group, User
+
+from balancer import pinning
+from balancer.middleware import (
+    PINNING_MODELS_KEY,
+    PinningSessionMiddleware,
+    PinningCookieMiddleware,
+)
+from balancer.routers import ModelPinningWMSRouter
+
+from . import BalancerTestCase
+
+
+class MockRequest(object):
+    method = 'POST'
+
+    def __init__(self):
+        self.COOKIES = {}
+        self.session = {}
+
+
+class MockResponse(object):
+
+    def __init__(self):
+        self.cookies = {}
+
+    def set_cookie(self, key, value, max_age):
+        self.cookies[key] = value
+
+
+class ModelPinningWMSRouterTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(ModelPinningWMSRouterTestCase, self).setUp()
+        self.router = ModelPinningWMSRouter()
+
+    def tearDown(self):
+        super(ModelPinningWMSRouterTestCase, self).tearDown()
+        pinning.unpin_models()
+        pinning.clear_model_writes()
+
+    def reads(self, model):
+        return set(self.router.db_for_read(model) for i in range(100))
+
+    def test_pinning(self):
+        """Only the model that was written should be pinned."""
+        self.assertEqual(self.reads(Group), set(['default', 'other']))
+
+        self.assertEqual(self.router.db_for_write(Group), 'default')
+        self.assertEqual(pinning.models_written(), frozenset(['auth.group']))
+        self.assertEqual(self.reads(Group), set(['default']))
+        self.assertEqual(self.reads(User), set(['default', 'other']))
+        self.assertFalse(pinning.thread_is_pinned())
+
+    def test_middleware(self):
+        for middleware in (PinningSessionMiddleware(),
+                           PinningCookieMiddleware()):
+            request = MockRequest()
+            middleware.process_request(request)
+            self.router.db_for_write(Group)
+            response = middleware.process_response(request, MockResponse())
+            self.assertEqual(pinning.pinned_models(), frozenset())
+            self.assertEqual(pinning.models_written(), frozenset())
+
+            request.COOKIES = response.cookies
+            middleware.process_request(request)
+            self.assertEqual(pinning.pinned_models(),
+                             frozenset(['auth.group']))
+            self.assertEqual(self.reads(User), set(['default', 'other']))
+
+            # A later write keeps the earlier models pinned.
+            self.router.db_for_write(User)
+            response = middleware.process_response(request, MockResponse())
+            request.COOKIES = response.cookies
+            middleware.process_request(request)
+            self.assertEqual(pinning.pinned_models(),
+                             frozenset(['auth.group', 'auth.user']))
+            pinning.unpin_models()
+
+        # Expired models are dropped from the session.
+        request = MockRequest()
+        request.session[PINNING_MODELS_KEY] = {'auth.group': time.time() - 1}
+        PinningSessionMiddleware().process_request(request)
+        self.assertEqual(pinning.pinned_models(), frozenset())
@@ -0,0 +1,114 @@
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+
+import balancer
+from balancer import pinning
+from balancer.context import sticky_scope
+from balancer.routers import (
+    AffinityMasterSlaveRouter, PinningWMSRouter, RandomRouter,
+)
+
+from . import BalancerTestCase
+
+
+class OverrideTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(OverrideTestCase, self).setUp()
+        settings.DATABASE_POOL = ['other']
+        settings.DATABASE_POOLS = {'reporting': ['utility']}
+        self.router = PinningWMSRouter()
+
+    def tearDown(self):
+        super(OverrideTestCase, self).tearDown()
+        del settings.DATABASE_POOLS
+        pinning.unpin_thread()
+
+    def read(self):
+        return self.router.db_for_read(self.obj1)
+
+    def test_use_master(self):
+        self.assertEqual(self.read(), 'other')
+        with balancer.use_master():
+            self.assertEqual(self.read(), 'default')
+            with balancer.use_pool('reporting'):
+                self.assertEqual(self.read(), 'utility')
+            self.assertEqual(self.read(), 'default')
+        self.assertEqual(self.read(), 'other')
+
+    def test_use_pool(self):
+        pinning.pin_thread()
+
+        @balancer.use_pool('reporting')
+        def report():
+            return self.read()
+
+        self.assertEqual(report(), 'utility')
+        self.assertEqual(self.read(), 'default')
+
+    def test_scope(self):
+        """Named pools are remembered apart from the pool in a scope."""
+        with sticky_scope():
+            self.assertEqual(self.read(), 'other')
+            with balancer.use_pool('reporting'):
+                self.assertEqual(self.read(), 'utility')
+            self.assertEqual(self.read(), 'other')
+
+    def test_unknown_pool(self):
+        with balancer.use_pool('missing'):
+            self.assertRaises(ImproperlyConfigured, self.read)
+
+    def test_read_from_replica(self):
+        pinning.pin_thread()
+
+        @balancer.read_from_replica
+        def read():
+            return self.read()
+
+        @balancer.read_from_replica
+        async def aread():
+            return self.read()
+
+        self.assertEqual(read(), 'other')
+        self.assertEqual(asyncio.run(aread()), 'other')
+        self.assertEqual(self.read(), 'default')
+
+    def test_async_decorators(self):
+        @balancer.use_master()
+        async def master():
+            return self.read()
+
+        @balancer.use_pool('reporting')
+        async def report():
+            return self.read()
+
+        self.assertEqual(asyncio.run(master()), 'default')
+        self.assertEqual(asyncio.run(report()), 'utility')
+        self.assertEqual(self.read(), 'other')
+
+    def test_instance_hint(self):
+        """Overrides take precedence over the instance hint."""
+        self.obj2._state.db = 'other'
+        with balancer.use_master():
+            self.assertEqual(
+                self.router.db_for_read(self.obj1, instance=self.obj2),
+                'default')
+
+    def test_affinity(self):
+        router = AffinityMasterSlaveRouter()
+        with balancer.use_pool('reporting'):
+            self.assertEqual(router.db_for_read(self.obj1), 'utility')
+
+    def test_relations(self):
+        self.assertEqual(self.router.state.related,
+                         frozenset(['default', 'other', 'utility']))
+
+    def test_setting_changed(self):
+        router = RandomRouter()
+        with override_settings(DATABASE_POOLS={'reporting': ['default']}):
+            with balancer.use_pool('reporting'):
+                self.assertEqual(router.db_for_read(self.obj1), 'default')
+            self.assertEqual(router.pool, ['other'])
@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+
+from balancer import instrumentation, pinning, writes
+from balancer.routers import ModelPinningWMSRouter, PinningWMSRouter
+
+from . import BalancerTestCase
+
+
+class PinOnCommitTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(PinOnCommitTestCase, self).setUp()
+        settings.MASTER_PINNING_MODE = 'commit'
+        self.router = PinningWMSRouter()
+
+    def tearDown(self):
+        super(PinOnCommitTestCase, self).tearDown()
+        del settings.MASTER_PINNING_MODE
+        instrumentation.remove_observer(writes.observer)
+        pinning.unpin_thread()
+        pinning.clear_db_write()
+        pinning.unpin_models()
+        pinning.clear_model_writes()
+
+    def test_routing_does_not_pin(self):
+        self.assertEqual(self.router.db_for_write(self.obj1), 'default')
+        self.assertFalse(pinning.thread_is_pinned())
+        self.assertFalse(pinning.db_was_written())
+
+    def test_committed_write(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Group.objects.create(name='editors')
+            self.assertFalse(pinning.thread_is_pinned())
+        self.assertTrue(pinning.thread_is_pinned())
+        self.assertTrue(pinning.db_was_written())
+        self.assertEqual(pinning.models_written(), frozenset(['auth.group']))
+        self.assertTrue(pinning.model_is_pinned('auth.group'))
+        self.assertEqual(self.router.db_for_read(self.obj1), 'default')
+
+    def test_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Group.objects.create(name='editors')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(pinning.thread_is_pinned())
+
+    def test_reads(self):
+        Group.objects.create(name='editors')
+        pinning.unpin_thread()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Group.objects.get_or_create(name='editors')
+            with transaction.atomic():
+                list(Group.objects.select_for_update())
+        self.assertEqual(callbacks, [])
+        self.assertFalse(pinning.thread_is_pinned())
+
+    def test_autocommit(self):
+        self.assertTrue(connection.in_atomic_block)
+        connection.in_atomic_block = False
+        try:
+            writes.observer.write_succeeded(
+                'default', 'UPDATE "auth_group" SET "name" = %s')
+        finally:
+            connection.in_atomic_block = True
+        self.assertTrue(pinning.model_is_pinned('auth.group'))
+
+    def test_other_databases(self):
+        """Writes to a database that isn't the master don't pin."""
+        writes.observer.write_succeeded(
+            'utility', 'UPDATE "auth_group" SET "name" = %s')
+        self.assertFalse(pinning.thread_is_pinned())
+        self.assertFalse(pinning.model_is_pinned('auth.group'))
+
+    def test_get_table(self):
+        for sql in ('INSERT INTO "auth_group" ("name") VALUES (%s)',
+                    'UPDATE "public"."auth_group" SET "name" = %s',
+                    'DELETE FROM `db`.`auth_group` WHERE `id` = %s',
+                    'insert into [dbo].[auth_group](name) values (%s)',
+                    'REPLACE INTO auth_group VALUES (1)'):
+            self.assertEqual(writes.get_table(sql), 'auth_group')
+        self.assertIsNone(writes.get_table('SELECT 1'))
+
+    def test_model_pinning(self):
+        router = ModelPinningWMSRouter()
+        router.db_for_write(Group)
+        self.assertFalse(pinning.model_is_pinned('auth.group'))
+
+    def test_invalid_mode(self):
+        settings.MASTER_PINNING_MODE = 'sometimes'
+        self.assertRaises(ImproperlyConfigured, PinningWMSRouter)
+
+    def test_is_write(self):
+        self.assertTrue(instrumentation.is_write(' insert into t values (1)'))
+        self.assertTrue(instrumentation.is_write('DELETE FROM t'))
+        self.assertFalse(instrumentation.is_write('SELECT 1'))
+        self.assertFalse(instrumentation.is_write(None))
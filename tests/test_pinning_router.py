@@ -0,0 +1,80 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from balancer import pinning
+from balancer.middleware import (
+    PINNING_KEY,
+    AsyncPinningSessionMiddleware,
+    AsyncPinningCookieMiddleware,
+)
+
+
+class MockRequest(object):
+    method = 'POST'
+
+    def __init__(self, cookies=(), session=None):
+        self.COOKIES = list(cookies)
+        self.session = session if session is not None else {}
+
+
+class MockResponse(object):
+    cookie = None
+
+    def set_cookie(self, key, value, max_age):
+        self.cookie = key
+
+
+class PinningContextTestCase(SimpleTestCase):
+
+    def tearDown(self):
+        pinning.unpin_thread()
+        pinning.clear_db_write()
+
+    def test_tasks_are_isolated(self):
+        """A pin set by one task should not leak into a concurrent task."""
+        seen = {}
+
+        async def pinned():
+            pinning.pin_thread()
+            await asyncio.sleep(0.01)
+            seen['pinned'] = pinning.thread_is_pinned()
+
+        async def unpinned():
+            await asyncio.sleep(0.005)
+            seen['unpinned'] = pinning.thread_is_pinned()
+
+        async def main():
+            await asyncio.gather(pinned(), unpinned())
+
+        asyncio.run(main())
+        self.assertEqual(seen, {'pinned': True, 'unpinned': False})
+        self.assertFalse(pinning.thread_is_pinned())
+
+    def test_async_middleware(self):
+        for middleware_class in (AsyncPinningSessionMiddleware,
+                                 AsyncPinningCookieMiddleware):
+            seen = []
+
+            async def view(request):
+                seen.append(pinning.thread_is_pinned())
+                pinning.set_db_write()
+                return MockResponse()
+
+            middleware = middleware_class(view)
+            self.assertTrue(middleware.is_async)
+
+            async def main():
+                request = MockRequest()
+                response = await middleware(request)
+                if response.cookie:
+                    request.COOKIES.append(response.cookie)
+                else:
+                    self.assertIn(PINNING_KEY, request.session)
+                # The follow-up request is pinned, an unrelated one is not.
+                await asyncio.gather(middleware(request),
+                                     middleware(MockRequest()))
+
+            asyncio.run(main())
+            self.assertEqual(sorted(seen), [False, False, True])
+            self.assertFalse(pinning.thread_is_pinned())
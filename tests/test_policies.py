@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+import balancer
+from balancer import pinning
+from balancer.routers import PinningWMSRouter, RandomRouter
+
+from . import BalancerTestCase
+
+
+def make_model(app_label, model_name):
+    class Meta(object):
+        pass
+
+    Meta.app_label = app_label
+    Meta.label_lower = '%s.%s' % (app_label, model_name)
+
+    class Model(object):
+        _meta = Meta
+
+    return Model
+
+
+Event = make_model('analytics', 'event')
+Session = make_model('sessions', 'session')
+Summary = make_model('analytics', 'summary')
+Order = make_model('shop', 'order')
+
+
+class PolicyTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(PolicyTestCase, self).setUp()
+        settings.DATABASE_POOL = ['other']
+        settings.DATABASE_POOLS = {'reporting': ['utility']}
+        settings.DATABASE_POOL_POLICIES = {
+            'analytics.*': 'reporting',
+            'analytics.Summary': 'replica',
+            'sessions.Session': 'master',
+        }
+        self.router = PinningWMSRouter()
+
+    def tearDown(self):
+        super(PolicyTestCase, self).tearDown()
+        del settings.DATABASE_POOLS
+        del settings.DATABASE_POOL_POLICIES
+        pinning.unpin_thread()
+
+    def read(self, model):
+        return self.router.db_for_read(model)
+
+    def test_policies(self):
+        self.assertEqual(self.read(Event), 'utility')
+        self.assertEqual(self.read(Session), 'default')
+        self.assertEqual(self.read(Order), 'other')
+
+    def test_model_wins_over_app(self):
+        self.assertEqual(self.read(Summary), 'other')
+
+    def test_pinned(self):
+        """Only the master and named pool policies win over pinning."""
+        pinning.pin_thread()
+        self.assertEqual(self.read(Event), 'utility')
+        self.assertEqual(self.read(Summary), 'default')
+        self.assertEqual(self.read(Order), 'default')
+
+    def test_override_wins(self):
+        with balancer.use_master():
+            self.assertEqual(self.read(Event), 'default')
+
+    def test_writes(self):
+        self.assertEqual(self.router.db_for_write(Event), 'default')
+
+    def test_setting_changed(self):
+        settings.DATABASE_POOL_POLICIES = {}
+        router = PinningWMSRouter()
+        with self.settings(DATABASE_POOL_POLICIES={'shop': 'master'}):
+            self.assertEqual(router.db_for_read(Order), 'default')
+        self.assertEqual(router.db_for_read(Order), 'other')
+
+    def test_set_pool(self):
+        """Replacing the named pools checks the policies against them."""
+        self.assertRaises(ImproperlyConfigured, self.router.set_pool,
+                          ['other'], pools={})
+        self.assertEqual(self.read(Event), 'utility')
+        self.router.set_pool(['other'], pools={'reporting': ['other']})
+        self.assertEqual(self.read(Event), 'other')
+
+    def test_unknown_pool(self):
+        settings.DATABASE_POOL_POLICIES = {'shop': 'missing'}
+        self.assertRaises(ImproperlyConfigured, PinningWMSRouter)
+
+    def test_master_required(self):
+        settings.MASTER_DATABASE = None
+        settings.DATABASE_POOL_POLICIES = {'shop': 'master'}
+        self.assertRaises(ImproperlyConfigured, RandomRouter)
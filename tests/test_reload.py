@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+
+from balancer import reload
+from balancer.routers import WeightedMasterSlaveRouter
+
+from . import BalancerTestCase
+
+
+class ReloadTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(ReloadTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pool.json')
+
+    def tearDown(self):
+        super(ReloadTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+        if hasattr(settings, 'DATABASE_POOL_FILE'):
+            del settings.DATABASE_POOL_FILE
+            del settings.DATABASE_POOL_FILE_INTERVAL
+
+    def reads(self, router):
+        return set(router.db_for_read(self.obj1) for i in range(100))
+
+    def test_set_pool(self):
+        router = WeightedMasterSlaveRouter()
+        state = router.state
+        router.set_pool({'utility': 1})
+        self.assertEqual(self.reads(router), set(['utility']))
+        self.assertEqual(router.pool, ['utility'])
+        # The old snapshot is left alone for anyone still holding it.
+        self.assertEqual(state.aliases, ('default', 'other'))
+        self.assertRaises(ValueError, reload.set_pool, {})
+
+    def test_setting_changed(self):
+        router = WeightedMasterSlaveRouter()
+        with override_settings(DATABASE_POOL=['utility'],
+                               MASTER_DATABASE='other'):
+            self.assertEqual(self.reads(router), set(['utility']))
+            self.assertEqual(router.db_for_write(self.obj1), 'other')
+        self.assertEqual(self.reads(router), set(['default', 'other']))
+        self.assertEqual(router.db_for_write(self.obj1), 'default')
+
+    def test_pool_file(self):
+        settings.DATABASE_POOL_FILE = self.path
+        settings.DATABASE_POOL_FILE_INTERVAL = 0
+        router = WeightedMasterSlaveRouter()
+        self.assertEqual(self.reads(router), set(['default', 'other']))
+
+        call_command('set_database_pool', 'other=2', 'utility',
+                     stdout=open(os.devnull, 'w'))
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {'pool': {'other': 2,
+                                                     'utility': 1}})
+        self.assertEqual(self.reads(router), set(['other', 'utility']))
+
+        # A broken file is ignored.
+        with open(self.path, 'w') as f:
+            f.write('{')
+        os.utime(self.path, ns=(0, 0))
+        with self.assertLogs('balancer.reload', 'ERROR'):
+            self.assertEqual(self.reads(router), set(['other', 'utility']))
+
+    def test_command_errors(self):
+        self.assertRaises(CommandError, call_command, 'set_database_pool',
+                          'other')
+        settings.DATABASE_POOL_FILE = self.path
+        settings.DATABASE_POOL_FILE_INTERVAL = 0
+        self.assertRaises(CommandError, call_command, 'set_database_pool',
+                          'missing')
+        self.assertRaises(CommandError, call_command, 'set_database_pool',
+                          'other=x')
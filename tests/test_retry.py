@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.db.backends.signals import connection_created
+
+from balancer import context, retry
+from balancer.context import sticky_scope, use_pool
+from balancer.health import registry
+from balancer.routers import WeightedMasterSlaveRouter
+
+from . import BalancerTestCase
+
+
+class MockConnection(object):
+    alias = 'other'
+    in_atomic_block = False
+    autocommit = True
+    connection = object()
+    usable = False
+
+    def is_usable(self):
+        return self.usable
+
+
+class MockCursor(object):
+    cursor = None
+
+
+def fail(sql, params, many, context):
+    raise OperationalError('server closed the connection unexpectedly')
+
+
+class RetryTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(RetryTestCase, self).setUp()
+        settings.DATABASE_POOL_RETRY_READS = True
+        settings.DATABASE_POOL_CONNECT_CHECK = False
+        self.router = WeightedMasterSlaveRouter()
+        self.wrapper = retry.RetryWrapper()
+        self.context = {'connection': MockConnection(),
+                        'cursor': MockCursor()}
+
+    def tearDown(self):
+        super(RetryTestCase, self).tearDown()
+        del settings.DATABASE_POOL_RETRY_READS
+        del settings.DATABASE_POOL_CONNECT_CHECK
+        registry.reset()
+        connection_created.disconnect(dispatch_uid='balancer.retry')
+        for connection in connections.all():
+            connection.execute_wrappers[:] = [
+                wrapper for wrapper in connection.execute_wrappers
+                if not isinstance(wrapper, retry.RetryWrapper)]
+
+    def retry(self, sql='SELECT 1'):
+        with self.assertLogs('balancer.retry', 'WARNING'):
+            self.wrapper(fail, sql, None, False, self.context)
+
+    def test_retry(self):
+        self.retry()
+        self.assertEqual(self.context['cursor'].cursor.fetchone(), (1,))
+        self.assertFalse(registry.is_healthy('other'))
+
+    def test_scope_moves(self):
+        """The rest of the request reads from the database it retried on."""
+        with sticky_scope():
+            context.bind(context.get_scope(), self.router, 'other')
+            self.retry()
+            self.assertEqual(self.router.db_for_read(self.obj1), 'default')
+
+    def test_named_pool(self):
+        """Reads from a named pool are retried within that pool."""
+        settings.DATABASE_POOLS = {'reporting': ['other', 'utility']}
+        try:
+            router = WeightedMasterSlaveRouter()
+            with use_pool('reporting'):
+                self.assertEqual(retry.get_retry_db('other'), 'utility')
+            registry.reset()
+
+            with sticky_scope():
+                scope = context.get_scope()
+                context.bind(scope, (router, 'reporting'), 'other')
+                self.assertEqual(retry.get_retry_db('other'), 'utility')
+                self.assertEqual(scope[(router, 'reporting')], 'utility')
+            registry.reset()
+
+            # With nothing else in the pool, the master takes the read.
+            registry.trip('utility')
+            with use_pool('reporting'):
+                self.assertEqual(retry.get_retry_db('other'), 'default')
+        finally:
+            del settings.DATABASE_POOLS
+
+    def test_no_retry(self):
+        self.context['connection'].in_atomic_block = True
+        self.assertRaises(OperationalError, self.wrapper, fail, 'SELECT 1',
+                          None, False, self.context)
+        self.context['connection'].in_atomic_block = False
+        self.assertRaises(OperationalError, self.wrapper, fail,
+                          'UPDATE t SET a = 1', None, False, self.context)
+        self.assertTrue(registry.is_healthy('other'))
+
+        # The master isn't retried on a slave.
+        self.context['connection'].alias = 'default'
+        self.assertRaises(OperationalError, self.wrapper, fail, 'SELECT 1',
+                          None, False, self.context)
+
+    def test_query_error(self):
+        """Errors on a working connection are not retried."""
+        self.context['connection'].usable = True
+        self.assertRaises(OperationalError, self.wrapper, fail, 'SELECT 1',
+                          None, False, self.context)
+        self.assertTrue(registry.is_healthy('other'))
+
+    def test_failed_retry(self):
+        """The original error is raised if the retry fails too."""
+        self.assertRaises(OperationalError, self.wrapper, fail,
+                          'SELECT * FROM balancer_missing', None, False,
+                          self.context)
+
+    def test_installed(self):
+        wrappers = connections['default'].execute_wrappers
+        self.assertIsInstance(wrappers[0], retry.RetryWrapper)
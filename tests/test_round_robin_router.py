@@ -1,20 +1,65 @@
+import multiprocessing
+
 from django.conf import settings
 
+from balancer import selection
 from balancer.routers import RoundRobinRouter
 
 from . import BalancerTestCase
 
 
+def first_reads(router, count, queue):
+    queue.put([router.get_next_db() for i in range(count)])
+
+
 class RoundRobinRouterTestCase(BalancerTestCase):
 
     def setUp(self):
         super(RoundRobinRouterTestCase, self).setUp()
         settings.DATABASE_POOL = ['default', 'other', 'utility']
+        selection.set_worker_id(0)
         self.router = RoundRobinRouter()
 
+    def tearDown(self):
+        super(RoundRobinRouterTestCase, self).tearDown()
+        selection.set_worker_id(None)
+
     def test_sequential_db_selection(self):
         """Databases should cycle in order."""
         for i in range(10):
             self.assertEqual(self.router.get_next_db(), self.router.pool[0])
             self.assertEqual(self.router.get_next_db(), self.router.pool[1])
             self.assertEqual(self.router.get_next_db(), self.router.pool[2])
+
+    def test_worker_offset(self):
+        """Each worker should start the cycle at its own offset."""
+        selection.set_worker_id(4)
+        self.assertEqual(self.router.get_next_db(), self.router.pool[1])
+        self.assertEqual(RoundRobinRouter().get_next_db(), self.router.pool[1])
+
+    def test_forked_workers(self):
+        """
+        Workers forked from a process that already routed queries should
+        spread their first queries evenly over the pool.
+        """
+        for i in range(5):
+            self.router.get_next_db()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=first_reads,
+                                   args=(self.router, 2, queue))
+                   for i in range(6)]
+        for worker in workers:
+            worker.start()
+        reads = [queue.get(timeout=10) for worker in workers]
+        for worker in workers:
+            worker.join()
+
+        firsts = {}
+        totals = {}
+        for worker_reads in reads:
+            firsts[worker_reads[0]] = firsts.get(worker_reads[0], 0) + 1
+            for alias in worker_reads:
+                totals[alias] = totals.get(alias, 0) + 1
+        self.assertEqual(firsts, {'default': 2, 'other': 2, 'utility': 2})
+        self.assertEqual(totals, {'default': 4, 'other': 4, 'utility': 4})
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.utils import ConnectionRouter
+
+from balancer import pinning
+from balancer.routers import (
+    PinningWMSRouter, RandomRouter, WeightedMasterSlaveRouter,
+)
+
+from . import BalancerTestCase
+
+
+class Obj(object):
+
+    def __init__(self, db):
+        self._state = type('State', (object,), {'db': db})
+
+
+class RoutingTableTestCase(BalancerTestCase):
+
+    def test_invalid_pool(self):
+        for pool in ([], ['default', 'missing'], {'default': -1},
+                     {'default': 'heavy'}, {'default': 0, 'other': 0}):
+            settings.DATABASE_POOL = pool
+            self.assertRaises(ImproperlyConfigured, RandomRouter)
+
+    def test_invalid_master(self):
+        settings.MASTER_DATABASE = 'missing'
+        self.assertRaises(ImproperlyConfigured, WeightedMasterSlaveRouter)
+        del settings.MASTER_DATABASE
+        self.assertRaises(ImproperlyConfigured, WeightedMasterSlaveRouter)
+
+    def test_checked_at_startup(self):
+        config = apps.get_app_config('balancer')
+        settings.DATABASE_POOL = ['default', 'missing']
+        router = ConnectionRouter(['balancer.routers.RandomRouter'])
+        with mock.patch('django.db.router', router):
+            self.assertRaises(ImproperlyConfigured, config.ready)
+
+    def test_set_pool_is_checked(self):
+        router = WeightedMasterSlaveRouter()
+        self.assertRaises(ImproperlyConfigured, router.set_pool, ['missing'])
+        self.assertEqual(router.pool, ['default', 'other'])
+
+    def test_membership(self):
+        settings.DATABASE_POOL = ['other']
+        router = WeightedMasterSlaveRouter()
+        self.assertEqual(router.state.members, frozenset(['other']))
+        self.assertEqual(router.state.related,
+                         frozenset(['default', 'other']))
+
+        router.master = 'utility'
+        self.assertEqual(router.state.related,
+                         frozenset(['other', 'utility']))
+        self.assertIsNone(router.allow_relation(Obj('default'), Obj('other')))
+        self.assertTrue(router.allow_relation(Obj('utility'), Obj('other')))
+        self.assertTrue(router.allow_migrate('utility', 'tests'))
+
+    def test_pinned_reads_use_master(self):
+        router = PinningWMSRouter()
+        router.master = 'utility'
+        router.db_for_write(self.obj1)
+        try:
+            self.assertEqual(router.db_for_read(self.obj1), 'utility')
+        finally:
+            pinning.unpin_thread()
+            pinning.clear_db_write()
@@ -0,0 +1,41 @@
+from django.test import SimpleTestCase
+
+from balancer.selection import (
+    UniformSelector, WeightedSelector, normalize_pool,
+)
+
+
+class SelectionTestCase(SimpleTestCase):
+
+    def test_normalize_pool(self):
+        self.assertEqual(normalize_pool(['a', 'b']), (('a', 1), ('b', 1)))
+        self.assertEqual(normalize_pool({'a': 3}), (('a', 3),))
+
+    def test_empty_pool(self):
+        self.assertRaises(ValueError, UniformSelector, ())
+        self.assertRaises(ValueError, WeightedSelector, (('a', 0),))
+
+    def test_weighted_tables(self):
+        """The alias table should reproduce the weights exactly."""
+        weights = (('a', 1), ('b', 2), ('c', 5), ('d', 0))
+        selector = WeightedSelector(weights)
+        self.assertEqual(selector.aliases, ('a', 'b', 'c'))
+
+        shares = dict((alias, 0.0) for alias in selector.aliases)
+        for i in range(selector.count):
+            shares[selector.aliases[i]] += selector.prob[i]
+            shares[selector.aliases[selector.alias_index[i]]] += (
+                1.0 - selector.prob[i])
+        for alias, weight in weights[:3]:
+            self.assertAlmostEqual(shares[alias] / selector.count,
+                                   weight / 8.0)
+
+    def test_weighted_choice(self):
+        selector = WeightedSelector((('a', 1), ('b', 3)))
+        hits = {'a': 0, 'b': 0}
+        for i in range(4000):
+            hits[selector.choice()] += 1
+        rate = float(hits['a']) / hits['b']
+        self.assertTrue(0.25 <= rate <= 0.45,
+                        "The 'a' rate of %s was not close enough to the "
+                        "target rate." % rate)
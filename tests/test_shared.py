@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from balancer import shared
+from balancer.health import HealthRegistry
+from balancer.latency import LatencyTracker
+from balancer.load import LoadTracker
+from balancer.shared import SharedState
+
+from . import BalancerTestCase
+
+
+def trip(path, alias):
+    registry = HealthRegistry()
+    registry.share(SharedState(path))
+    registry.trip(alias)
+
+
+def try_lock(state):
+    import fcntl
+    try:
+        fcntl.flock(state.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os._exit(0)
+    os._exit(1)
+
+
+def crash(path, alias):
+    tracker = LoadTracker()
+    tracker.share(SharedState(path))
+    tracker.query_started(alias)
+    # Exit without releasing the row.
+    os._exit(0)
+
+
+class SharedStateTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(SharedStateTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state')
+        # Two states mapping the same file stand in for two workers.
+        self.first = SharedState(self.path)
+        self.second = SharedState(self.path)
+        self.first.totals_interval = self.second.totals_interval = 0
+
+    def tearDown(self):
+        super(SharedStateTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_health(self):
+        first, second = HealthRegistry(), HealthRegistry()
+        first.share(self.first)
+        second.share(self.second)
+        self.assertEqual(second.get_unhealthy(), frozenset())
+        first.trip('other')
+        self.assertEqual(second.get_unhealthy(), frozenset(['other']))
+
+        # Success elsewhere doesn't close the circuit before it expires.
+        second.record_success('other')
+        self.assertFalse(second.is_healthy('other'))
+        first.reset()
+        self.assertTrue(second.is_healthy('other'))
+
+    def test_forked_worker(self):
+        registry = HealthRegistry()
+        registry.share(self.first)
+        process = multiprocessing.get_context('fork').Process(
+            target=trip, args=(self.path, 'utility'))
+        process.start()
+        process.join()
+        self.assertEqual(registry.get_unhealthy(), frozenset(['utility']))
+
+    def test_forked_worker_lock(self):
+        """A forked worker doesn't share the parent's file lock."""
+        with self.first.locked():
+            process = multiprocessing.get_context('fork').Process(
+                target=try_lock, args=(self.first,))
+            process.start()
+            process.join()
+        self.assertEqual(process.exitcode, 0)
+
+    def test_full_table(self):
+        with self.assertLogs('balancer.shared', 'WARNING'):
+            for i in range(shared.MAX_ALIASES + 1):
+                self.first.index('db%d' % i)
+        alias = 'db%d' % shared.MAX_ALIASES
+        self.assertIsNone(self.first.indexes[alias])
+
+        # Aliases that don't fit are tracked by each process.
+        tracker = LoadTracker()
+        tracker.share(self.first)
+        tracker.query_started(alias)
+        self.assertEqual(tracker.get_in_flight(alias), 1)
+
+    def test_in_flight(self):
+        first, second = LoadTracker(), LoadTracker()
+        first.share(self.first)
+        second.share(self.second)
+        first.query_started('other')
+        first.query_started('other')
+        second.query_started('other')
+        self.assertEqual(first.get_in_flight('other'), 3)
+        self.assertEqual(second.in_flight.get('other', 0), 3)
+        first.query_finished('other', 0.1, None)
+        self.assertEqual(second.get_in_flight('other'), 2)
+        self.assertEqual(second.get_in_flight('default'), 0)
+
+    def test_exited_worker(self):
+        process = multiprocessing.get_context('fork').Process(
+            target=crash, args=(self.path, 'other'))
+        process.start()
+        process.join()
+        self.assertEqual(self.first.get_other_in_flight()['other'], 1)
+        self.first.check_workers()
+        self.assertEqual(self.first.get_other_in_flight()['other'], 0)
+
+    def test_totals_interval(self):
+        first, second = LoadTracker(), LoadTracker()
+        first.share(self.first)
+        second.share(self.second)
+        self.first.totals_interval = 60
+        first.query_started('other')
+        self.assertEqual(first.get_in_flight('other'), 1)
+        # Other workers are seen once the totals are added up again, while
+        # this worker's own queries count straight away.
+        second.query_started('other')
+        first.query_started('other')
+        self.assertEqual(first.get_in_flight('other'), 2)
+        self.first.totals_interval = 0
+        self.assertEqual(first.get_in_flight('other'), 3)
+
+    def test_latency(self):
+        first, second = LatencyTracker(), LatencyTracker()
+        first.share(self.first)
+        second.share(self.second)
+        first.record('other', 0.010)
+        second.record('other', 0.030)
+        self.assertAlmostEqual(first.get_latency('other'), 0.012)
+        self.assertEqual(first.get_latency('default'), 0.0)
+        second.reset()
+        self.assertEqual(first.get_latency('other'), 0.0)
+
+    def test_bad_file(self):
+        with open(self.path + '.bad', 'w') as f:
+            f.write('not a state file')
+        self.assertRaises(ImproperlyConfigured, SharedState,
+                          self.path + '.bad')
+
+    def test_get_state(self):
+        self.assertIsNone(shared.get_state())
+        settings.DATABASE_POOL_SHARED_STATE = self.path
+        try:
+            state = shared.get_state()
+            self.assertIs(shared.get_state(), state)
+        finally:
+            del settings.DATABASE_POOL_SHARED_STATE
@@ -0,0 +1,55 @@
+from django.conf import settings
+
+from balancer.context import sticky_scope
+from balancer.middleware import StickyMiddleware
+from balancer.routers import WeightedMasterSlaveRouter
+
+from . import BalancerTestCase
+
+
+class StickyTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(StickyTestCase, self).setUp()
+        self.router = WeightedMasterSlaveRouter()
+
+    def reads(self):
+        return set(self.router.db_for_read(self.obj1) for i in range(100))
+
+    def test_scope(self):
+        self.assertEqual(self.reads(), set(['default', 'other']))
+        seen = set()
+        for i in range(50):
+            with sticky_scope():
+                reads = self.reads()
+                self.assertEqual(len(reads), 1)
+                seen |= reads
+        self.assertEqual(seen, set(['default', 'other']))
+
+    def test_excluded_db_is_replaced(self):
+        with sticky_scope():
+            alias = self.router.db_for_read(self.obj1)
+            self.router.get_excluded = lambda: frozenset([alias])
+            self.assertNotEqual(self.router.db_for_read(self.obj1), alias)
+
+    def test_disabled(self):
+        settings.DATABASE_POOL_STICKY = False
+        try:
+            self.router = WeightedMasterSlaveRouter()
+        finally:
+            del settings.DATABASE_POOL_STICKY
+        with sticky_scope():
+            self.assertEqual(self.reads(), set(['default', 'other']))
+
+    def test_middleware(self):
+        seen = []
+
+        def view(request):
+            seen.append(self.reads())
+            return None
+
+        middleware = StickyMiddleware(view)
+        for i in range(10):
+            middleware(object())
+        for reads in seen:
+            self.assertEqual(len(reads), 1)
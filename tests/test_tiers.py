@@ -0,0 +1,91 @@
+import gc
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from balancer import drain
+from balancer.health import registry
+from balancer.routers import HealthCheckWMSRouter, WeightedRandomRouter
+
+from . import BalancerTestCase
+
+
+class TiersTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(TiersTestCase, self).setUp()
+        settings.DATABASE_POOL = {'default': 1, 'other': 1, 'utility': 3}
+        settings.DATABASE_POOL_TIERS = [['other', 'utility']]
+        self.router = WeightedRandomRouter()
+
+    def tearDown(self):
+        super(TiersTestCase, self).tearDown()
+        del settings.DATABASE_POOL_TIERS
+        drain.set_draining(())
+
+    def reads(self, count=100):
+        return set(self.router.db_for_read(self.obj1) for i in range(count))
+
+    def test_first_tier(self):
+        self.assertEqual(self.reads(), set(['other', 'utility']))
+
+    def test_weights_within_tier(self):
+        reads = [self.router.db_for_read(self.obj1) for i in range(4000)]
+        self.assertAlmostEqual(reads.count('utility') / 4000.0, 0.75,
+                               delta=0.05)
+
+    def test_spill_over(self):
+        """The databases left out of the tiers are the last tier."""
+        drain.drain('other')
+        self.assertEqual(self.reads(), set(['utility']))
+        drain.drain('utility')
+        self.assertEqual(self.reads(), set(['default']))
+        drain.undrain('other')
+        self.assertEqual(self.reads(), set(['other']))
+
+    def test_setting_changed(self):
+        # Drop the routers of earlier tests, whose pools may not fit the tiers
+        gc.collect()
+        with self.settings(DATABASE_POOL_TIERS=[['default']]):
+            self.assertEqual(self.reads(), set(['default']))
+        self.assertEqual(self.reads(), set(['other', 'utility']))
+
+    def test_unknown_alias(self):
+        settings.DATABASE_POOL_TIERS = [['other', 'missing']]
+        self.assertRaises(ImproperlyConfigured, WeightedRandomRouter)
+
+    def test_alias_outside_pool(self):
+        settings.DATABASE_POOL = ['default', 'other']
+        self.assertRaises(ImproperlyConfigured, WeightedRandomRouter)
+
+    def test_rejected_setting(self):
+        """A tier config that is rejected leaves the old tiers in place."""
+        self.assertRaises(ImproperlyConfigured, self.router.set_pool,
+                          dict(self.router.state.weights),
+                          tiers=[['missing']])
+        self.assertEqual(self.router.tier_aliases, (('other', 'utility'),))
+        self.router.set_pool(['default', 'other', 'utility'])
+        self.assertEqual(self.reads(), set(['other', 'utility']))
+
+
+class HealthCheckTiersTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(HealthCheckTiersTestCase, self).setUp()
+        settings.DATABASE_POOL = ['other', 'utility']
+        settings.DATABASE_POOL_TIERS = [['other'], ['utility']]
+        settings.DATABASE_POOL_CONNECT_CHECK = False
+        self.router = HealthCheckWMSRouter()
+
+    def tearDown(self):
+        super(HealthCheckTiersTestCase, self).tearDown()
+        del settings.DATABASE_POOL_TIERS
+        del settings.DATABASE_POOL_CONNECT_CHECK
+        registry.reset()
+
+    def test_falls_back_to_master(self):
+        self.assertEqual(self.router.db_for_read(self.obj1), 'other')
+        registry.trip('other')
+        self.assertEqual(self.router.db_for_read(self.obj1), 'utility')
+        registry.trip('utility')
+        self.assertEqual(self.router.db_for_read(self.obj1), 'default')
@@ -0,0 +1,35 @@
+from unittest import mock
+
+from django.conf import settings
+from django.db import OperationalError, connections
+
+from balancer.health import registry
+from balancer.warmup import get_aliases, warm_up
+
+from . import BalancerTestCase
+
+
+class WarmUpTestCase(BalancerTestCase):
+
+    def tearDown(self):
+        super(WarmUpTestCase, self).tearDown()
+        registry.reset()
+
+    def test_aliases(self):
+        self.assertEqual(get_aliases(), ['default', 'other'])
+        settings.DATABASE_POOL = ['other', 'utility']
+        self.assertEqual(get_aliases(), ['other', 'utility', 'default'])
+
+    def test_warm_up(self):
+        connection = connections['utility']
+        with mock.patch.object(connection, 'ensure_connection',
+                               side_effect=OperationalError('refused')):
+            with self.assertLogs('balancer.warmup', 'WARNING'):
+                results = warm_up(['default', 'utility'])
+
+        self.assertEqual([result.alias for result in results],
+                         ['default', 'utility'])
+        self.assertEqual(results[0].error, None)
+        self.assertTrue(results[0].seconds >= 0)
+        self.assertTrue(isinstance(results[1].error, OperationalError))
+        self.assertEqual(registry.get_unhealthy(), frozenset(['utility']))
@@ -0,0 +1,95 @@
+import threading
+
+from django.conf import settings
+
+from balancer import selection
+from balancer.routers import (
+    WeightedRoundRobinRouter, WeightedRoundRobinMasterSlaveRouter,
+)
+
+from . import BalancerTestCase, MasterSlaveTestMixin
+
+
+class WeightedRoundRobinRouterTestCase(BalancerTestCase):
+
+    def setUp(self):
+        super(WeightedRoundRobinRouterTestCase, self).setUp()
+        settings.DATABASE_POOL = {
+            'default': 5,
+            'other': 1,
+            'utility': 1,
+        }
+        selection.set_worker_id(0)
+        self.router = WeightedRoundRobinRouter()
+
+    def tearDown(self):
+        super(WeightedRoundRobinRouterTestCase, self).tearDown()
+        selection.set_worker_id(None)
+
+    def test_smooth_sequence(self):
+        """The heaviest database should be interleaved, not sent in a burst."""
+        sequence = [self.router.get_next_db() for i in range(7)]
+        self.assertEqual(sequence, ['default', 'default', 'other', 'default',
+                                    'utility', 'default', 'default'])
+
+    def test_float_weights(self):
+        settings.DATABASE_POOL = {'default': 1.5, 'other': 0.5}
+        router = WeightedRoundRobinRouter()
+        sequence = [router.get_next_db() for i in range(4)]
+        self.assertEqual(sequence, ['default', 'default', 'other', 'default'])
+
+    def test_weights_are_reduced(self):
+        settings.DATABASE_POOL = {'default': 20, 'other': 10}
+        router = WeightedRoundRobinRouter()
+        self.assertEqual(router.selector.period, 3)
+
+    def test_large_weights(self):
+        settings.DATABASE_POOL = {'default': 300000, 'other': 100001}
+        router = WeightedRoundRobinRouter()
+        period = router.selector.period
+        self.assertLessEqual(period, router.selector.max_period)
+        sequence = [router.get_next_db() for i in range(period)]
+        self.assertAlmostEqual(sequence.count('other') / float(period), 0.25,
+                               delta=0.001)
+
+    def test_worker_offsets(self):
+        """The first reads of a full set of workers follow the weights."""
+        firsts = {'default': 0, 'other': 0, 'utility': 0}
+        for worker_id in range(7):
+            selection.set_worker_id(worker_id)
+            firsts[self.router.get_next_db()] += 1
+        self.assertEqual(firsts, {'default': 5, 'other': 1, 'utility': 1})
+
+    def test_concurrent_distribution(self):
+        """
+        Concurrent callers should share one schedule, so that the combined
+        distribution matches the weights exactly.
+        """
+        hits = []
+
+        def worker():
+            local = {'default': 0, 'other': 0, 'utility': 0}
+            for i in range(700):
+                local[self.router.get_next_db()] += 1
+            hits.append(local)
+
+        threads = [threading.Thread(target=worker) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        totals = {'default': 0, 'other': 0, 'utility': 0}
+        for local in hits:
+            for alias, count in local.items():
+                totals[alias] += count
+        self.assertEqual(totals, {'default': 8000, 'other': 1600,
+                                  'utility': 1600})
+
+
+class WRRMSRouterTestCase(MasterSlaveTestMixin, BalancerTestCase):
+    """Tests for the WeightedRoundRobinMasterSlaveRouter."""
+
+    def setUp(self):
+        super(WRRMSRouterTestCase, self).setUp()
+        self.router = WeightedRoundRobinMasterSlaveRouter()